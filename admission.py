@@ -0,0 +1,151 @@
+"""
+Admission control for a replica.
+
+Client /kvs requests and replica-to-replica /reptorep requests have separate budgets (CLIENT_CONCURRENCY,
+default 16, and PEER_CONCURRENCY, default 32), so a burst of clients cannot starve replication. Requests wait
+in a bounded queue for a slot; once the queue is full or the wait runs out they are shed with a 429 (clients)
+or 503 (replicas) and a Retry-After header, instead of timing out and getting healthy replicas removed from
+the View.
+
+Replicated writes (PUT/DELETE of a key or raw value on /reptorep) have a budget of their own
+(REPLICATION_CONCURRENCY, default 32) that waits without a time limit and only sheds once 1024 writes are
+waiting. The sender, replicate_write in app.py, retries a busy replica after its Retry-After, or with a longer
+timeout, for up to REPLICATION_DEADLINE seconds, and stops only once the write is delivered or the replica
+refuses connections and is declared down.
+
+Every response carries the replica's load in X-Load. PeerLoad remembers it, so forwarded requests go to the
+least loaded member of the owning shard; a forwarded write that times out is not sent to another member,
+which could apply it twice.
+"""
+
+import time
+import random
+import threading
+
+LOAD_HEADER = "X-Load"                          # Load of the replica that sent a response, 1.0 = every slot busy
+
+class Budget:
+    def __init__(self, name, limit, queue_limit, max_wait):
+        """
+        Initializes a bounded number of requests that may be handled at once.
+        Requests beyond the limit wait in a queue; once the queue is full, or a request has
+        waited <max_wait> seconds, further requests are shed instead of piling up.
+        A budget with neither a queue limit nor a longest wait never sheds; requests wait until a slot frees.
+
+        :param name: The name the budget is reported under
+        :param limit: The number of requests handled at once
+        :param queue_limit: The number of requests that may wait for a slot, or None for no limit
+        :param max_wait: The longest a request waits for a slot in seconds, or None to wait until one frees
+        """
+        self.name = name
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.max_wait = max_wait
+        self.slots = threading.BoundedSemaphore(limit)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+
+    def acquire(self):
+        """
+        Waits for a slot.
+        RETURN: True if the request was admitted, False if it was shed
+        """
+        with self.lock:
+            if self.queue_limit is not None and self.waiting >= self.queue_limit:
+                self.shed += 1
+                return False
+            self.waiting += 1
+
+        admitted = self.slots.acquire(timeout=self.max_wait)
+        with self.lock:
+            self.waiting -= 1
+            if admitted:
+                self.active += 1
+                self.admitted += 1
+            else:
+                self.shed += 1
+        return admitted
+
+    def release(self):
+        """
+        Frees the slot of an admitted request.
+        """
+        with self.lock:
+            self.active -= 1
+        self.slots.release()
+
+    def load(self):
+        """
+        Returns the requests handled or waiting relative to the limit; above 1.0 means requests are queueing.
+        """
+        with self.lock:
+            return (self.active + self.waiting) / self.limit
+
+    def retry_after(self):
+        """
+        Returns how many seconds a shed request should wait before it is retried.
+        """
+        return max(1, round((self.max_wait or 1) * self.load()))
+
+    def snapshot(self):
+        """
+        Returns a copy of the counters.
+        """
+        with self.lock:
+            return {"limit": self.limit, "queue-limit": self.queue_limit, "active": self.active,
+                    "waiting": self.waiting, "admitted": self.admitted, "shed": self.shed}
+
+class PeerLoad:
+    def __init__(self, ttl=5.0):
+        """
+        Initializes a record of the load other replicas reported in their responses.
+
+        :param ttl: How long a reported load is trusted, in seconds
+        """
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.loads = {}                         # peer -> (load, time reported)
+
+    def record(self, peer, load):
+        """
+        Records the <load> reported by <peer>, ignoring responses without a load.
+        """
+        if load is None:
+            return
+        try:
+            load = float(load)
+        except ValueError:
+            return
+        with self.lock:
+            self.loads[peer] = (load, time.monotonic())
+
+    def get(self, peer):
+        """
+        Returns the last load reported by <peer>, or 0 if it has not reported one recently.
+        """
+        with self.lock:
+            load, reported = self.loads.get(peer, (0.0, 0.0))
+        return load if time.monotonic() - reported <= self.ttl else 0.0
+
+    def by_load(self, reps):
+        """
+        Returns the replicas in <reps> from the least to the most loaded, in random order between ties.
+        """
+        return sorted(reps, key=lambda rep: (self.get(rep), random.random()))
+
+    def least_loaded(self, reps):
+        """
+        Returns the replica in <reps> that last reported the lowest load.
+        """
+        return self.by_load(reps)[0]
+
+    def snapshot(self):
+        """
+        Returns the recently reported load of each peer.
+        """
+        with self.lock:
+            peers = list(self.loads)
+        return {peer: self.get(peer) for peer in peers}
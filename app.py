@@ -1,10 +1,26 @@
-from flask import Flask, request, jsonify
-from collections import defaultdict
+from flask import Flask, request, jsonify, Response
+from collections import defaultdict, deque
 import requests, os
 import time
-import random
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, TimeoutError as FuturesTimeoutError
+import json
+import base64
+import heapq
 import jsonpickle
 from consistent_hash import ConsistentRing
+from hot_keys import SpaceSavingCounter, HotKeyCache
+from rebalancer import plan_rebalance, shard_loads, load_ratio
+from compression import (CompressionStats, DecompressingMiddleware, choose_codec, compress, deflate_stream,
+                         supported_codecs, COMPRESS_THRESHOLD, CODECS_HEADER)
+from urllib.parse import urlparse
+from bloom_filter import BloomFilter, ShardSummary
+from tracing import Tracer, TracedSession, stage, sample_profile, current_stage
+from admission import Budget, PeerLoad, LOAD_HEADER
+from change_feed import ChangeFeed
+from key_index import KeyIndex
+import key_versions
 
 # Initializations
 MY_ADDRESS = os.environ['SOCKET_ADDRESS']
@@ -14,33 +30,229 @@ try:
 except KeyError:
     shard_count = None
 
+# The simulator drives startup and background work itself instead of using threads
+SIMULATION = os.environ.get('KVS_SIMULATION') is not None
+
+# Causality is tracked with one vector clock over every replica by default. With CAUSAL_MODE=per-key,
+# each key carries the version of its latest write and a request only depends on the keys it touches
+PER_KEY = os.environ.get('CAUSAL_MODE', 'vector') == 'per-key'
+
 shards = {}
-shard_value_map = {} 
+shard_summaries = {}                            # Other shards -> Bloom filter and key count of their keys
+summary_pending = defaultdict(set)              # Keys created in other shards since their last summary refresh
 current_shard = None
 Store = {}
+BlobStore = {}                                  # Raw byte values uploaded through /kvs/<key>/raw
+keyIndex = KeyIndex()                           # The keys of Store in sorted order, used by scans
+shardSummary = ShardSummary()                   # Bloom filter of the keys of Store, served to other shards
 VectorClock = {}
+KeyVersion = {}                                 # Key -> version of its latest write, kept after deletes (per-key mode)
+versionLock = threading.Lock()                  # Makes checking a write's version and applying it to Store one step
 consistentRing = ConsistentRing(1000)
 View = {}
 View = set(MY_VIEW.split(',')) 
 View.add(MY_ADDRESS)
 
+# Hot keys of other shards are cached here once their reads cross the threshold
+HOT_KEY_THRESHOLD = 50
+hotKeyCounter = SpaceSavingCounter(64)
+hotKeyCache = HotKeyCache(256, lease=1.0)
+
+# Writes applied by this replica, streamed to downstream consumers from /shard/changes
+changeFeed = ChangeFeed(int(os.environ.get('CHANGE_FEED_CAPACITY', 10000)), MY_ADDRESS)
+
+# Client requests per second over a rolling window, used by the rebalancer; reading it does not reset it
+REQUEST_RATE_WINDOW = 60
+request_buckets = deque()                       # [second, requests served in that second], oldest first
+requestLock = threading.Lock()
+load_window_start = time.time()
+
+# Every call to another replica goes through one pooled session that carries the trace id
+tracer = Tracer(MY_ADDRESS, sample_rate=float(os.environ.get('TRACE_SAMPLE_RATE', 0.1)))
+peer_session = TracedSession(tracer)
+traced = stage(tracer)
+
+# Codecs each peer advertised it can decode, learned from its responses
+peer_codecs = {}
+compressionStats = CompressionStats()
+
+# Client and replica-to-replica requests have separate budgets so a burst of clients cannot starve replication
+clientBudget = Budget("client", int(os.environ.get('CLIENT_CONCURRENCY', 16)), queue_limit=64, max_wait=1.0)
+peerBudget = Budget("peer", int(os.environ.get('PEER_CONCURRENCY', 32)), queue_limit=128, max_wait=0.5)
+# Replicated writes wait for a slot instead of timing out; only a very long queue is shed, with a 503 the sender retries
+replicationBudget = Budget("replication", int(os.environ.get('REPLICATION_CONCURRENCY', 32)), queue_limit=1024, max_wait=None)
+REPLICATED_WRITES = {"Rec_Val_From_Rep", "Rec_Val_From_Rep_del", "Rec_Raw_From_Rep", "Rec_Raw_From_Rep_del"}
+peerLoad = PeerLoad()
+
+def record_peer_load(res, *args, **kwargs):
+    """
+    Remembers the load another replica reported in its response.
+    """
+    peerLoad.record(urlparse(res.url).netloc, res.headers.get(LOAD_HEADER))
+
+peer_session.hooks["response"].append(record_peer_load)
+
 app = Flask(__name__)
+app.wsgi_app = DecompressingMiddleware(app.wsgi_app, compressionStats)
+
+@app.before_request
+def start_trace():
+    """
+    Joins the trace of the replica that sent this request, or starts a new trace for a client request.
+    """
+    # Kept in the request environ rather than g, since g is shared when a replica calls itself in-process
+    request.environ['kvs.trace'] = (tracer.start_request(request.headers),
+                                    current_stage.set(request.endpoint or "request"),
+                                    time.perf_counter())
+
+@app.after_request
+def record_trace(response):
+    """
+    Records the time this replica spent handling the request.
+    """
+    if 'kvs.trace' in request.environ:
+        start = request.environ['kvs.trace'][2]
+        tracer.record(f"{request.method} {request.url_rule}", None, time.perf_counter() - start, response.status_code)
+    return response
+
+@app.teardown_request
+def end_trace(exception):
+    """
+    Restores the trace context once the request is finished.
+    """
+    if 'kvs.trace' in request.environ:
+        trace_token, stage_token, start = request.environ.pop('kvs.trace')
+        current_stage.reset(stage_token)
+        tracer.end_request(trace_token)
+
+def budget_for(path, endpoint=None):
+    """
+    Returns the budget that requests to <path> are admitted under, or None for unbudgeted requests.
+
+    :param path: The path of the request
+    :param endpoint: The view function the request was routed to
+    """
+    if path.startswith('/kvs'):
+        return clientBudget
+    if endpoint in REPLICATED_WRITES:
+        return replicationBudget
+    if path.startswith('/reptorep'):
+        return peerBudget
+    return None
+
+@app.before_request
+def admit_request():
+    """
+    Admits the request under the budget for its kind of traffic, or sheds it once that budget's queue is full.
+    Clients are told to back off with a 429; replicas get a 503 so they retry without treating this replica as down.
+    Replicated writes wait for a slot of their own budget instead, which also keeps the VC updates they send
+    from waiting on the slots the writes hold.
+    """
+    budget = budget_for(request.path, request.endpoint)
+    if budget is None:
+        return
+    if not budget.acquire():
+        status = 429 if budget is clientBudget else 503
+        return {"error": "Replica is overloaded; try again later"}, status, {"Retry-After": str(budget.retry_after())}
+    request.environ['kvs.budget'] = budget
+
+@app.after_request
+def report_load(response):
+    """
+    Tells the requester how loaded this replica is so it can steer later requests elsewhere.
+    """
+    response.headers[LOAD_HEADER] = f"{max(clientBudget.load(), peerBudget.load(), replicationBudget.load()):.2f}"
+    return response
+
+@app.teardown_request
+def release_budget(exception):
+    """
+    Frees the slot of an admitted request.
+    """
+    budget = request.environ.pop('kvs.budget', None)
+    if budget is not None:
+        budget.release()
+
+def peer_put(rep_url, data, timeout):
+    """
+    Sends <data> as a JSON PUT to another replica, compressing the body when that replica
+    has advertised a codec it can decode and the body is large enough to benefit.
+
+    :param rep_url: The URL of the replica endpoint
+    :param data: The JSON serializable body
+    :param timeout: The request timeout in seconds
+    RETURN: The response from the replica
+    """
+    rep = urlparse(rep_url).netloc
+    body = json.dumps(data).encode()
+    codec = choose_codec(len(body), peer_codecs.get(rep))
+    headers = {"Content-Type": "application/json"}
+    wire = body
+    if codec is not None:
+        wire = compress(body, codec)
+        headers["Content-Encoding"] = codec
+    compressionStats.record("sent", codec, len(body), len(wire))
+
+    res = peer_session.put(rep_url, data=wire, headers=headers, timeout=timeout)
+    advertised = res.headers.get(CODECS_HEADER)
+    if advertised is not None:
+        peer_codecs[rep] = [name.strip() for name in advertised.split(',')]
+    return res
+
+@app.after_request
+def compress_response(response):
+    """
+    Advertises the codecs this replica decodes, and compresses large replica-to-replica JSON responses
+    such as /existinginfo when the requester accepts deflate.
+    """
+    response.headers[CODECS_HEADER] = ", ".join(supported_codecs())
+    peer_paths = ('/existinginfo', '/reptorep', '/shard')
+    if (not request.path.startswith(peer_paths) or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype != 'application/json'
+            or 'deflate' not in request.headers.get('Accept-Encoding', '')):
+        return response
+
+    body = response.get_data()
+    if len(body) >= COMPRESS_THRESHOLD:
+        wire = compress(body, "deflate")
+        response.set_data(wire)
+        response.headers['Content-Encoding'] = 'deflate'
+        response.headers['Vary'] = 'Accept-Encoding'
+        compressionStats.record("response", "deflate", len(body), len(wire))
+    return response
+
+BOOTSTRAP_DEADLINE = 3                          # Seconds startup waits for any one phase
+
+def in_parallel(func, reps):
+    """
+    Starts func(rep) for every replica in <reps> on its own thread, keeping the current trace.
+    The pool is not waited on, so slow replicas cannot hold up the caller past its own deadline.
+
+    :param func: The function to call with each replica
+    :param reps: The replicas to call it for
+    RETURN: A dict of future -> replica
+    """
+    reps = list(reps)
+    pool = ThreadPoolExecutor(max_workers=max(1, min(32, len(reps))))
+    futures = {pool.submit(contextvars.copy_context().run, func, rep): rep for rep in reps}
+    pool.shutdown(wait=False)
+    return futures
 
 # Description: 
-def blast_add(new_replica_socket_address):
+@traced
+def blast_add(new_replica_socket_address, deadline=BOOTSTRAP_DEADLINE):
     """
     Sends a request to each replica in this replica's view, asking to be placed in their View.
+    The requests are sent in parallel and this waits at most <deadline> seconds for them.
     :param new_replica_socket_address: Will always be the current replica's address
+    :param deadline: The number of seconds to wait for all replicas to answer
     """
-    for rep in View:
-        if rep == MY_ADDRESS:
-            continue
-
+    def announce(rep):
         rep_url = f"http://{rep}/viewed"
         data = {"socket-address": new_replica_socket_address}
         
         try:
-            res = requests.put(rep_url, json=data, timeout=1.5)
+            res = peer_put(rep_url, data, timeout=1.5)
             if res.status_code == 200 or res.status_code == 201:
                 print(f"A PUT to {rep} was successful")
         except requests.exceptions.Timeout:
@@ -48,9 +260,11 @@ def blast_add(new_replica_socket_address):
         except requests.exceptions.RequestException as e:
             print(f"We ran into a non-timeout error when sending a PUT request to {rep}")
 
+    wait(in_parallel(announce, [rep for rep in View if rep != MY_ADDRESS]), timeout=deadline)
+
 def init_shards(num_shards):
     """Initializes vars related to sharding after verifying that enough replicas exist."""
-    global current_shard, shard_value_map, consistentRing
+    global current_shard, consistentRing
     shard_building = {}
     for i in range(num_shards):
         shard_building[f"s{i}"] = list()
@@ -59,13 +273,14 @@ def init_shards(num_shards):
     for j, replica in enumerate(sorted(View)):
         shard_building[f"s{j % num_shards}"].append(replica)
     
-    # Build shard->keys map and add shard to hash ring
+    # Add shards to hash ring, the summaries of the old shards no longer apply
+    shard_summaries.clear()
+    summary_pending.clear()
     for shard, replicas in shard_building.items():
         if len(replicas) < 2:
             raise notEnoughShardsError
         if MY_ADDRESS in replicas:
             current_shard = shard
-        shard_value_map[shard] = set()
         consistentRing.add_new_shard(shard)
     
     return shard_building
@@ -75,27 +290,68 @@ class notEnoughShardsError(Exception):
 
 @app.route('/existinginfo', methods=['GET'])
 def send_info():
-    return {'store': Store, 'vc': VectorClock}, 200
-
-def get_info():
-    """Until it receives a response, asks every replica in its view for the VC and Store data."""
-    if current_shard is not None:
-        for rep in shards[current_shard]:
-            if rep != MY_ADDRESS:
-                rep_url = f"http://{rep}/existinginfo"
-                try:
-                    response = requests.get(rep_url, timeout=0.5)
-                    if response.status_code == 200:
-                        data = response.json()
-                        global Store, VectorClock
-                        Store = data.get('store')
-                        VectorClock = data.get('vc')
-                        return True
-                except requests.exceptions.RequestException as e:
-                    continue
+    return {'store': Store, 'vc': VectorClock, 'versions': KeyVersion}, 200
+
+@traced
+def get_info(deadline=BOOTSTRAP_DEADLINE):
+    """
+    Asks every other replica in its shard for a snapshot of its VC, Store, and raw values in parallel.
+    Catches up from the first replica that is ready, or starts empty once every other replica has answered
+    that it is starting up without any data. Writes replicated meanwhile are buffered and replayed afterwards.
+    Waits at most <deadline> seconds for the headers of the snapshots; only the chosen snapshot is read in
+    full, however long that takes, and the other streams are closed.
+    RETURN: True if this replica caught up, False if it has to try again
+    """
+    if current_shard is None:
+        return True
+    peers = [rep for rep in shards[current_shard] if rep != MY_ADDRESS]
+    if not peers:
+        install_snapshot({"store": {}, "blobs": {}, "vc": {}, "versions": {}})
+        return True
 
-# Initialize shards and VC
-blast_add(MY_ADDRESS)
+    # The snapshot stream carries raw values too, which /existinginfo does not
+    futures = in_parallel(open_snapshot, peers)
+    chosen, source, empty = None, None, 0
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            try:
+                opened = future.result()
+            except requests.exceptions.RequestException as e:
+                continue
+            if opened is None:
+                continue
+            res, lines, header = opened
+            if header['ready']:
+                chosen, source = opened, futures[future]
+                break
+            # A peer that is starting up too only counts once it confirms it has no data
+            if header['keys'] == 0 and header['raw-keys'] == 0:
+                empty += 1
+                if empty == len(peers):
+                    chosen, source = opened, futures[future]
+                    break
+    except FuturesTimeoutError:
+        print("No replica in my shard sent a snapshot header before the deadline")
+    finally:
+        # Every stream but the chosen one is closed, including those still being opened
+        for pending in futures:
+            pending.add_done_callback(lambda pending: close_snapshot(pending, chosen))
+
+    if chosen is None:
+        return False
+    res, lines, header = chosen
+    try:
+        with res:
+            snapshot = read_snapshot_body(lines, header)
+    except requests.exceptions.RequestException as e:
+        print(f"The snapshot stream from {source} broke off")
+        return False
+    if snapshot is None:
+        return False
+    install_snapshot(snapshot)
+    return True
+
+# Initialize shards and VC, the network part of startup runs in the background (see bootstrap)
 if shard_count is not None:
     shards = init_shards(shard_count)
     for shard, replicas in shards.items():
@@ -105,8 +361,6 @@ if shard_count is not None:
 for i in View:
     VectorClock[i] = 0
 
-get_info()
-
 
 
 # Key-Value Store Operations =================================================================================
@@ -127,7 +381,71 @@ def LessThanOrEqualTo(VC_Client, VC_Replica):
             
     return True
 
+def causally_ready(metadata, key, known=None):
+    """
+    Checks whether a read of <key> can be served without breaking the client's causal dependencies.
+    In vector mode the client's whole vector clock is compared; in per-key mode only its version of <key>.
+
+    :param metadata: The causal metadata sent by the client
+    :param key: The key that is read; raw values are tracked as "<key>/raw"
+    :param known: The causal metadata a cached value was read at, instead of this replica's
+    RETURN: True if the request can be served
+    """
+    if not PER_KEY:
+        return LessThanOrEqualTo(metadata, VectorClock if known is None else known)
+    version = KeyVersion.get(key) if known is None else key_versions.dependency(known, key)
+    return key_versions.covers(version, key_versions.dependency(metadata, key))
+
+def causal_metadata(metadata, key):
+    """
+    Returns the causal metadata sent back to the client after a request on <key>.
+    In per-key mode this is the client's metadata with this replica's version of <key> merged in.
+    """
+    if not PER_KEY:
+        return VectorClock
+    return key_versions.merge(metadata, {key: KeyVersion.get(key)})
+
+def new_version(metadata, key):
+    """
+    Gives a client's write of <key> a version newer than any this replica or the client has seen.
+    """
+    KeyVersion[key] = key_versions.next_version(MY_ADDRESS, KeyVersion.get(key), key_versions.dependency(metadata, key))
+    return KeyVersion[key]
+
+def apply_version(key, version):
+    """
+    Records the version of a write of <key> made at another replica.
+    RETURN: False if a newer write of <key> was already applied here, so this one must be skipped
+    """
+    if not PER_KEY:
+        return True
+    if not key_versions.newer(version, KeyVersion.get(key)):
+        return False
+    KeyVersion[key] = version
+    return True
+
+def merge_versions(versions):
+    """
+    Records every version in <versions> that is newer than the one known here.
+    """
+    for key, version in versions.items():
+        apply_version(key, version)
+
+def take_moved_versions():
+    """
+    Takes the versions of the keys, including deleted ones, that the ring now assigns to other shards out of
+    KeyVersion in a single pass, to send along when keys move. Versions of keys that moved away are not kept here.
+    RETURN: A dict of shard -> versions of the keys that shard now owns
+    """
+    moved = defaultdict(dict)
+    for key in list(KeyVersion.keys()):
+        shard, hash_value = consistentRing.key_to_shard(key.removesuffix("/raw"))
+        if shard != current_shard:
+            moved[shard][key] = KeyVersion.pop(key)
+    return moved
+
 # Forwarding and Broadcast Operations -----------------------------------------------------------------
+@traced
 def forwardget(i, key, vc):
     """
     Forwards a GET request to the shard that contains the requested key.
@@ -136,19 +454,22 @@ def forwardget(i, key, vc):
     :param key: The key that the client wants the value of
     :param vc: The vector clock that the client sent to the original request 
     """
-    shard = shards[i]
-    repl = random.randrange(len(shard))
     data = {'causal-metadata': vc}
-    # Forward the request
-    try:
-        rep_url = f"http://{shard[repl]}/kvs/{key}"
-        res = requests.get(rep_url, json=data, timeout=2)
-        return res
-    except requests.exceptions.Timeout:
-        print(f"A PUT request to {repl} timed out")
-    except requests.exceptions.RequestException as e:
-        print(f"We ran into a non-timeout error when sending a PUT request to {repl}")
+    res = None
+    # Forward the request to the least loaded replica, moving on to the next if it sheds the request
+    for repl in peerLoad.by_load(shards[i]):
+        try:
+            rep_url = f"http://{repl}/kvs/{key}"
+            res = peer_session.get(rep_url, json=data, timeout=2)
+            if res.status_code != 429:
+                return res
+        except requests.exceptions.Timeout:
+            print(f"A PUT request to {repl} timed out")
+        except requests.exceptions.RequestException as e:
+            print(f"We ran into a non-timeout error when sending a PUT request to {repl}")
+    return res
 
+@traced
 def forwardput(i, key, value, vc):
     """
     Forwards a PUT request to the shard that should contain the key.
@@ -158,20 +479,26 @@ def forwardput(i, key, value, vc):
     :param value: The value that the client wants the key to have
     :param vc: The vector clock that the client sent to the original request 
     """
-    shard = shards[i]
-    rep = random.randrange(len(shard))
-    rep_url = f"http://{shard[rep]}/kvs/{key}"
     data = {"value": value, "causal-metadata": vc}
-    # Forward the request
-    try:
-        res = requests.put(rep_url, json=data, timeout=2)
-        if res.status_code == 200 or res.status_code == 201:
-            return res
-    except requests.exceptions.Timeout:
-        print(f"A PUT request to {rep} timed out")
-    except requests.exceptions.RequestException as e:
-        print(f"We ran into a non-timeout error when sending a PUT request to {rep}")
+    res = None
+    # Forward the request to the least loaded replica, moving on to the next if it sheds the request
+    # or cannot be reached. Once a replica has the request it is not sent elsewhere, or it could be applied twice
+    for rep in peerLoad.by_load(shards[i]):
+        rep_url = f"http://{rep}/kvs/{key}"
+        try:
+            res = peer_put(rep_url, data, timeout=FORWARD_TIMEOUT)
+            if res.status_code != 429:
+                return res
+        except requests.exceptions.ConnectTimeout:
+            print(f"A PUT request to {rep} could not connect in time")
+        except requests.exceptions.Timeout:
+            print(f"A PUT request to {rep} timed out and may still be applied")
+            return None
+        except requests.exceptions.RequestException as e:
+            print(f"We ran into a non-timeout error when sending a PUT request to {rep}")
+    return res
 
+@traced
 def forwarddelete(i, key):
     """
     Forwards a delete request to the shard that has key <key>.
@@ -184,25 +511,36 @@ def forwarddelete(i, key):
         data = {"causal-metadata": None}
 
         try:
-            res = requests.delete(rep_url, json=data, timeout=0.5)
+            res = peer_session.delete(rep_url, json=data, timeout=FORWARD_TIMEOUT)
             if res.status_code == 200:
                 return res
+        except requests.exceptions.ConnectTimeout:
+            print(f"A DELETE request to {rep} could not connect in time")
         except requests.exceptions.Timeout:
-            print(f"A PUT request to {rep} timed out")
+            print(f"A DELETE request to {rep} timed out and may still be applied")
+            return None
         except requests.exceptions.RequestException as e:
             print(f"We ran into a non-timeout error when sending a PUT request to {rep}")
 
-def blast_vc():
+@traced
+def blast_vc(key=None):
     """
     Broadcasts the vector clock of this replica to maintain causal consistency at all replicas.
+
+    :param key: The key that was just written, if any, so replicas can invalidate cached copies of it
     """
+    # Per-key versions travel with each replicated write instead. Cached copies of <key> in other shards
+    # are then only dropped when their lease runs out, which is safe because a cached copy is only served
+    # to clients whose metadata does not require a newer version of the key
+    if PER_KEY:
+        return
     for rep in View:
         if rep != MY_ADDRESS:
             rep_url = f"http://{rep}/reptorep/updatevc"
-            data = {"vc": VectorClock}
+            data = {"vc": VectorClock, "key": key}
 
             try:
-                res = requests.put(rep_url, json=data, timeout=2.5)
+                res = peer_put(rep_url, data, timeout=2.5)
                 if res.status_code == 200:
                     print(f"Successful blast to {rep}")
             except requests.exceptions.Timeout:
@@ -210,13 +548,57 @@ def blast_vc():
             except requests.exceptions.RequestException as e:
                 print(f"We ran into a non-timeout error when sending a PUT request to {rep}")
 
-def blast_put_key(key, value, from_rep):
+REPLICATION_DEADLINE = 10                       # Seconds a replicated write is retried at a replica that is up but busy
+FORWARD_TIMEOUT = REPLICATION_DEADLINE + 2      # Seconds a forwarded write waits for its owner, which replicates it first
+
+def replicate_write(rep, send, to_remove):
+    """
+    Sends a replicated write to <rep> until it is delivered or <rep> is declared down.
+    A replica that answers with a 503 is retried after its Retry-After, and one that does not answer in time
+    is retried with a longer timeout, for up to REPLICATION_DEADLINE seconds. A replica that refuses the
+    connection twice is declared down and added to <to_remove>.
+
+    :param rep: The replica the write is sent to
+    :param send: A function that sends the write with the given timeout and returns the response
+    :param to_remove: The replicas found to be down
+    RETURN: The response once the write was delivered, otherwise None
     """
-    Repeats PUT request unicasts to the shard that <key> should be assigned to until a successful PUT.
+    timeout, waited, refused = 1.0, 0, 0
+    while waited < REPLICATION_DEADLINE:
+        try:
+            response = send(timeout)
+            if response.status_code == 200 or response.status_code == 201:
+                return response
+            if response.status_code != 503:
+                print(f"A replicated write to {rep} was rejected with {response.status_code}")
+                return None
+            delay = float(response.headers.get('Retry-After', 0.5))
+        except requests.exceptions.ConnectionError:
+            refused += 1
+            if refused >= 2:
+                if rep in View:
+                    to_remove.add(rep)
+                return None
+            delay = 0.1
+        except requests.exceptions.Timeout:
+            waited += timeout
+            timeout = min(timeout * 2, 4.0)
+            delay = 0
+        time.sleep(delay)
+        waited += delay
+    print(f"A replicated write to {rep} was not delivered within {REPLICATION_DEADLINE}s")
+    return None
+
+@traced
+def blast_put_key(key, value, from_rep, version=None):
+    """
+    Repeats PUT request unicasts to the shard that <key> should be assigned to until a successful PUT
+    or the replica is declared down.
 
     :param key: The key that the client wishes to insert to the store
     :param value: The value that the key should have
     :param from_rep: The replica that originally received the request
+    :param version: The version of this write (per-key mode)
     """
     temp_View = View
     to_remove = set()
@@ -224,29 +606,21 @@ def blast_put_key(key, value, from_rep):
     for rep in shards[current_shard]:
         if rep != MY_ADDRESS:
             rep_url = f"http://{rep}/reptorep/{key}/{from_rep}"
-            data = {"value": value, "causal-metadata": VectorClock}
-            retries = 0
-            while retries < 2:
-                try:
-                    response = requests.put(rep_url, json=data, timeout=0.9)
-                    if response.status_code == 200 or response.status_code == 201:
-                        return True
-                except requests.exceptions.ConnectionError:
-                    if rep in View:
-                        to_remove.add(rep)
-                retries += 1
-                time.sleep(0.1)
-                
+            data = {"value": value, "causal-metadata": VectorClock, "version": version}
+            replicate_write(rep, lambda timeout: peer_put(rep_url, data, timeout=timeout), to_remove)
+
     for rep in to_remove:
         View.remove(rep)
         blast_delete(rep)
 
-def blast_delete_key(key, from_rep):
+@traced
+def blast_delete_key(key, from_rep, version=None):
     """
     Broadcasts a DELETE request to the replicas in the shard that should contain <key>.
 
     :param key: The key that is to be deleted from the key-value store.
     :param from_rep: The replica that originally received the DELETE request.
+    :param version: The version of this delete (per-key mode)
     """
     temp_View = View
     to_remove = set()
@@ -255,29 +629,22 @@ def blast_delete_key(key, from_rep):
     for rep in shards[current_shard]:
         if rep != MY_ADDRESS:
             rep_url = f"http://{rep}/reptorep/{key}/{from_rep}"
-            data = {"causal-metadata": VectorClock, "from_shard":current_shard}
-            retries = 0
-            while retries < 2:
-                try:
-                    response = requests.delete(rep_url, json=data, timeout=1.0)
-                    if response.status_code == 200 or response.status_code == 201:
-                        max_clock = {}
-                        new_VC = response.json()["causal-metadata"]
-                        for rep_vc in set(VectorClock.keys()).union(new_VC.keys()):
-                            VectorClock[rep_vc] = max(VectorClock.get(rep_vc, 0), new_VC.get(rep_vc, 0))
-                        break
-                except requests.exceptions.ConnectionError:
-                    if rep in View:
-                        to_remove.add(rep)
-                retries += 1
-                time.sleep(0.5)
+            data = {"causal-metadata": VectorClock, "from_shard":current_shard, "version": version}
+            response = replicate_write(rep, lambda timeout: peer_session.delete(rep_url, json=data, timeout=timeout),
+                                       to_remove)
+            if response is not None:
+                new_VC = response.json()["causal-metadata"]
+                for rep_vc in set(VectorClock.keys()).union(new_VC.keys()):
+                    VectorClock[rep_vc] = max(VectorClock.get(rep_vc, 0), new_VC.get(rep_vc, 0))
     for rep in to_remove:
         View.remove(rep)
         blast_delete(rep)
 
+@traced
 def blast_map(key):
     """
-    Broadcast an update of the mapping of which shards holds the inserted key.
+    Broadcast the creation of a key so other replicas add it to the summary of this shard
+    before their next summary refresh.
 
     :param key: The key that was inserted/updated in the key-value store
     """
@@ -287,7 +654,7 @@ def blast_map(key):
             data = {"shard": current_shard}
 
             try:
-                res = requests.put(rep_url, json=data, timeout=2.5)
+                res = peer_put(rep_url, data, timeout=2.5)
                 if res.status_code == 200:
                     print(f"Successful blast to {rep}")
             except requests.exceptions.Timeout:
@@ -315,15 +682,25 @@ def Rec_Val_From_Rep(key, from_rep):
         return {"error": "Key is too long"}, 400
     value = data.get('value')
 
-    # Check if new key
-    if key not in Store.keys():
+    # Joining replicas apply writes after their snapshot
+    if buffer_if_joining("put", key, value, data.get('version'), from_rep):
+        return {"result": "buffered", "causal-metadata": VectorClock}, 201
+    with versionLock:
+        if not apply_version(key, data.get('version')):
+            return {"result": "skipped", "causal-metadata": VectorClock}, 200
+        created = key not in Store.keys()
         Store[key] = value
-        blast_vc()
-        shard_value_map[current_shard].add(key)
+
+    # Check if new key
+    if created:
+        keyIndex.add(key)
+        shardSummary.add(key)
+        changeFeed.append("put", key, value, causal_metadata(None, key), from_rep)
+        blast_vc(key)
         return {"result": "created", "causal-metadata": VectorClock}, 201
     else:
-        Store[key] = value
-        blast_vc()
+        changeFeed.append("put", key, value, causal_metadata(None, key), from_rep)
+        blast_vc(key)
         return {"result": "replaced", "causal-metadata": VectorClock}, 200
 
 @app.route('/reptorep/<key>/<from_rep>', methods=['DELETE'])
@@ -340,9 +717,6 @@ def Rec_Val_From_Rep_del(key, from_rep):
     VC_Incoming = data.get('causal-metadata')
     VectorClock[from_rep] = VectorClock[from_rep] + 1
     from_shard = data.get('from_shard')
-
-    # Add the key to this replica's key-shard map
-    shard_value_map[from_shard].add(key)
     
     #Check for Length of Key
     if len(key) > 50:
@@ -359,13 +733,24 @@ def Rec_Val_From_Rep_del(key, from_rep):
     for rep in set(VectorClock.keys()).union(VC_Incoming.keys()):
         VectorClock[rep] = max(VectorClock.get(rep, 0), VC_Incoming.get(rep, 0))
 
+    # Joining replicas apply writes after their snapshot
+    if buffer_if_joining("delete", key, None, data.get('version'), from_rep):
+        return {"result": "buffered", "causal-metadata": VectorClock}, 200
+    with versionLock:
+        if not apply_version(key, data.get('version')):
+            return {"result": "skipped", "causal-metadata": VectorClock}, 200
+        existed = key in Store.keys()
+        Store.pop(key, None)
+
     #Check if new key
-    if key not in Store.keys():
-        blast_vc()
+    if not existed:
+        blast_vc(key)
         return {"result": "created", "causal-metadata": VectorClock}, 201
     else:
-        del Store[key]
-        blast_vc()
+        keyIndex.discard(key)
+        shardSummary.invalidate()
+        changeFeed.append("delete", key, None, causal_metadata(None, key), from_rep)
+        blast_vc(key)
         return {"result": "replaced", "causal-metadata": VectorClock}, 200
 
 @app.route('/reptorep/updatevc', methods=['PUT'])
@@ -377,19 +762,45 @@ def updatevc():
     data = request.json
     vc = data.get('vc')
     VectorClock = vc
+
+    # The write this clock belongs to makes any cached copy of the key stale
+    if data.get('key') is not None:
+        hotKeyCache.invalidate(data.get('key'))
     return {"result": "sucessful update"}, 200
 
 @app.route('/reptorep/updatemap/<key>', methods=['PUT'])
 def updatemap(key):
     """
-    Receive an update for the mapping of keys to shards.
+    Receive a newly created key and add it to the summary of the shard that holds it.
     """
     data = request.json
     shard = data.get('shard')
-    shard_value_map[shard].add(key)
+    # Our own shard is never summarized, its keys are in keyIndex
+    if shard == current_shard:
+        return {"result": "own shard"}, 200
+    summary_pending[shard].add(key)
+    summary = shard_summaries.get(shard)
+    if summary is not None:
+        summary["filter"].add(key)
+        summary["key-count"] += 1
     return {"result": "successful update"}, 200
 
 # APIs used by clients to interact with KV-Store -----------------------------------------------------------------
+@app.before_request
+def count_request():
+    """
+    Counts client key-value requests so the request rate of this replica can be reported.
+    """
+    if request.path.startswith('/kvs/'):
+        second = int(time.time())
+        with requestLock:
+            if request_buckets and request_buckets[-1][0] == second:
+                request_buckets[-1][1] += 1
+            else:
+                request_buckets.append([second, 1])
+            while request_buckets[0][0] <= second - REQUEST_RATE_WINDOW:
+                request_buckets.popleft()
+
 @app.route('/kvs/<key>', methods=['GET'])
 def Get_Val_at_Rep(key):    
     """
@@ -402,24 +813,40 @@ def Get_Val_at_Rep(key):
     VC_Client = data.get('causal-metadata')
     
     # Determine if this GET request is causally consistent
-    check = LessThanOrEqualTo(VC_Client, VectorClock)
+    # In per-key mode, a key owned by another shard is checked by the replica the request is forwarded to
+    shard, hash_value = consistentRing.key_to_shard(key)
+    check = (PER_KEY and shard != current_shard) or causally_ready(VC_Client, key)
 
     # Causally Consistent Request
     if check == True:
         # We need to forward this request since we don't have this key
         if key not in Store.keys():
-            for i in shard_value_map:
-                if key in shard_value_map[i]:
-                    res = forwardget(i, key, VC_Client)
-                    dataforwarded = res.json()
-                    vc = dataforwarded.get('causal-metadata')
-                    k = dataforwarded.get('value')
-                    return {"result": "found", "value": k, "causal-metadata": vc}, 200
+            hits = hotKeyCounter.observe(key)
+
+            # Serve hot keys from the cache if the cached copy is causally new enough for the client
+            cached = hotKeyCache.get(key)
+            if cached is not None and causally_ready(VC_Client, key, cached[1]):
+                vc = key_versions.merge(VC_Client, cached[1]) if PER_KEY else cached[1]
+                return {"result": "found", "value": cached[0], "causal-metadata": vc}, 200
+
+            # The summary of the owning shard can tell us the key definitely does not exist
+            if shard != current_shard and might_contain(shard, key):
+                res = forwardget(shard, key, VC_Client)
+                if res is None:
+                    return {"error": "Shard is unavailable; try again later"}, 503, {"Retry-After": "1"}
+                dataforwarded = res.json()
+                if res.status_code != 200:
+                    return dataforwarded, res.status_code
+                vc = dataforwarded.get('causal-metadata')
+                k = dataforwarded.get('value')
+                if hits >= HOT_KEY_THRESHOLD:
+                    hotKeyCache.put(key, k, {key: key_versions.dependency(vc, key)} if PER_KEY else vc)
+                return {"result": "found", "value": k, "causal-metadata": vc}, 200
                     
             return {"error": "Key does not exist"}, 404
         else:
             blast_vc()
-            return {"result": "found", "value": Store[key], "causal-metadata": VectorClock}, 200
+            return {"result": "found", "value": Store[key], "causal-metadata": causal_metadata(VC_Client, key)}, 200
     # Non Causally Consistent Request
     else:
         return {"error": "Causal dependencies not satisfied; try again later"}, 503
@@ -440,18 +867,22 @@ def Put_Val_at_Rep(key):
 
     # Forward the request if our shard isn't assigned this key
     if shard != current_shard:
+        hotKeyCache.invalidate(key)
         res = forwardput(shard, key, value, vc)
-        return jsonify(res.json()), res.status_code
+        if res is None:
+            return {"error": "Shard is unavailable; try again later"}, 503, {"Retry-After": "1"}
+        headers = {"Retry-After": res.headers["Retry-After"]} if "Retry-After" in res.headers else {}
+        return jsonify(res.json()), res.status_code, headers
     
     # This key goes into our shard
     else:
         # Verify causal consistency
         VC_Incoming = data.get('causal-metadata')
         check = False
-        if VC_Incoming:
+        if VC_Incoming and not PER_KEY:
             check = LessThanOrEqualTo(VC_Incoming, VectorClock)
 
-        # Null PUT metadata has no dependencies
+        # Null PUT metadata has no dependencies, and in per-key mode a write never waits for other keys
         else:
             check = True
 
@@ -466,21 +897,29 @@ def Put_Val_at_Rep(key):
                 
                 #Increment VC of Replica and check causality again
                 VectorClock[MY_ADDRESS] = VectorClock[MY_ADDRESS] + 1
-                check = LessThanOrEqualTo(VC_Incoming, VectorClock)
+                check = PER_KEY or LessThanOrEqualTo(VC_Incoming, VectorClock)
                 if check == False:
                     return {"error": "Causal dependencies not satisfied; try again later"}, 503
-                
-                # Broadcast the PUT to other replicas in my shard
-                blast_vc()
-                blast_put_key(key, value, MY_ADDRESS)
-                if key not in Store.keys():
+
+                # Apply the write here before broadcasting it, so that a newer write of the key a peer
+                # replicates to us meanwhile is applied after it, as it is on the peers (per-key mode)
+                with versionLock:
+                    version = new_version(VC_Incoming, key) if PER_KEY else None
+                    created = key not in Store.keys()
                     Store[key] = value
-                    shard_value_map[current_shard].add(key)
+                    metadata = causal_metadata(VC_Incoming, key)
+                    changeFeed.append("put", key, value, causal_metadata(None, key), MY_ADDRESS)
+
+                # Broadcast the PUT to other replicas in my shard
+                blast_vc(key)
+                blast_put_key(key, value, MY_ADDRESS, version)
+                if created:
+                    keyIndex.add(key)
+                    shardSummary.add(key)
                     blast_map(key)
-                    return {"result": "created", "causal-metadata": VectorClock, "shard-id": current_shard}, 201
+                    return {"result": "created", "causal-metadata": metadata, "shard-id": current_shard}, 201
                 else:
-                    Store[key] = value
-                    return {"result": "replaced", "causal-metadata": VectorClock}, 200
+                    return {"result": "replaced", "causal-metadata": metadata}, 200
 
 @app.route('/kvs/<key>', methods=['DELETE'])
 def Delete_Val_at_Rep(key):
@@ -495,12 +934,12 @@ def Delete_Val_at_Rep(key):
     # Note that a 503 for DELETE requests is IMPOSSIBLE
     VC_Incoming = data.get('causal-metadata')
     check = False
-    if VC_Incoming:
+    if VC_Incoming and not PER_KEY:
         # Check Causal History to See if Less-Than-Or-Equal-To
         print(f"VC_Incoming: {VC_Incoming}")
         check = LessThanOrEqualTo(VC_Incoming, VectorClock)
 
-    # Null DELETE metadata has no dependencies
+    # Null DELETE metadata has no dependencies, and in per-key mode a write never waits for other keys
     else:
         print(f"VC_Incoming: Nothing yet!")
         check = True
@@ -509,27 +948,411 @@ def Delete_Val_at_Rep(key):
     if check == True:
         # Check if Key Exists
         if key not in Store.keys():
-            for i in shard_value_map:
-                if key in shard_value_map[i]:
-                    res = forwarddelete(i, key)
-                    dataforwarded = res.get_json()
-                    shard_value_map[current_shard].remove(key)
+            shard, hash_value = consistentRing.key_to_shard(key)
+            if shard != current_shard and might_contain(shard, key):
+                hotKeyCache.invalidate(key)
+                res = forwarddelete(shard, key)
+                if res is not None:
                     blast_vc()
+                    if PER_KEY:
+                        return {"result": "deleted", "causal-metadata": key_versions.merge(VC_Incoming, res.json().get('causal-metadata') or {})}, 200
                     return {"result": "deleted", "causal-metadata": VectorClock}, 200
             return {"error": "Key not found"}, 404
         
-        del Store[key]
-        blast_delete_key(key, MY_ADDRESS)
+        # As for a PUT, the delete is applied along with its version before it is broadcast
+        with versionLock:
+            Store.pop(key, None)
+            version = new_version(VC_Incoming, key) if PER_KEY else None
+            metadata = causal_metadata(VC_Incoming, key)
+            feed_metadata = causal_metadata(None, key)
+        keyIndex.discard(key)
+        shardSummary.invalidate()
+        blast_delete_key(key, MY_ADDRESS, version)
 
         # Increment VC of Replica
         VectorClock[MY_ADDRESS] += 1
-        blast_vc()
-        return {"result": "deleted", "causal-metadata": VectorClock}, 200
+        changeFeed.append("delete", key, None, feed_metadata, MY_ADDRESS)
+        blast_vc(key)
+        return {"result": "deleted", "causal-metadata": metadata}, 200
 
     # Else Return Causal Not Satisfied
     else:
         return {"error": "Causal dependencies not satisfied; try again later"}, 503
 
+# Scan APIs and Functions ===================================================================
+SCAN_MAX_LIMIT = 1000
+
+def scan_args():
+    """
+    Reads the prefix, cursor, and limit of a scan request.
+    The cursor is the last key of the previous page, url-safe base64 encoded.
+    RETURN: The prefix, the key to continue after (or None), and the limit
+    """
+    prefix = request.args.get('prefix', '')
+    cursor = request.args.get('cursor')
+    after = base64.urlsafe_b64decode(cursor.encode()).decode() if cursor else None
+    limit = min(max(1, int(request.args.get('limit', 100))), SCAN_MAX_LIMIT)
+    return prefix, after, limit
+
+@app.route('/shard/scan', methods=['GET'])
+def scan_shard():
+    """
+    Returns one page of this replica's keys in sorted order, along with their values if ?values=true.
+    Used by the /kvs scan coordinator; the cursor here is the plain last key in ?after=.
+    """
+    prefix = request.args.get('prefix', '')
+    after = request.args.get('after')
+    try:
+        limit = min(max(1, int(request.args.get('limit', 100))), SCAN_MAX_LIMIT)
+    except ValueError:
+        return {"error": "Invalid limit"}, 400
+    keys, more = keyIndex.page(prefix, after, limit)
+    if request.args.get('values') == 'true':
+        items = [[key, Store[key]] for key in keys if key in Store]
+    else:
+        items = [[key, None] for key in keys]
+    return {"shard-id": current_shard, "items": items, "more": more}, 200
+
+@traced
+def scan_page(shard, prefix, after, limit, values):
+    """
+    Fetches one page of keys from a member of <shard>, trying the least loaded member first.
+
+    :param shard: The shard to scan
+    :param prefix: Only keys starting with this are returned
+    :param after: Only keys sorting after this are returned
+    :param limit: The largest number of keys returned
+    :param values: Whether values are returned along with the keys
+    RETURN: The list of [key, value] pairs and whether the shard has more matching keys
+    """
+    if shard == current_shard:
+        keys, more = keyIndex.page(prefix, after, limit)
+        return [[key, Store.get(key) if values else None] for key in keys], more
+
+    params = {"prefix": prefix, "limit": limit, "values": "true" if values else "false"}
+    if after is not None:
+        params["after"] = after
+    for rep in peerLoad.by_load(shards[shard]):
+        try:
+            res = peer_session.get(f"http://{rep}/shard/scan", params=params, timeout=2)
+            if res.status_code == 200:
+                data = res.json()
+                return data.get('items'), data.get('more')
+        except requests.exceptions.Timeout:
+            print(f"A SCAN request to {rep} timed out")
+        except requests.exceptions.RequestException as e:
+            print(f"We ran into a non-timeout error when sending a SCAN request to {rep}")
+    raise requests.exceptions.ConnectionError(f"No member of {shard} answered the scan")
+
+@app.route('/kvs', methods=['GET'])
+def scan_keys():
+    """
+    Lists keys across every shard in sorted order, one page at a time.
+    Query parameters: ?prefix= to only list keys starting with it, ?limit= for the page size,
+    ?cursor= from the previous page's "next-cursor" to continue, and ?values=true to include values.
+    One member of every shard is asked for a page in parallel and the sorted pages are merged, so
+    a page never holds more than <limit> keys per shard in memory.
+    """
+    try:
+        prefix, after, limit = scan_args()
+    except ValueError:
+        return {"error": "Invalid cursor or limit"}, 400
+    values = request.args.get('values') == 'true'
+
+    futures = in_parallel(lambda shard: scan_page(shard, prefix, after, limit, values), shards.keys())
+    pages = []
+    more = False
+    for future, shard in futures.items():
+        try:
+            items, shard_more = future.result()
+        except requests.exceptions.RequestException as e:
+            return {"error": f"Shard {shard} is unavailable; try again later"}, 503, {"Retry-After": "1"}
+        pages.append(items)
+        more = more or shard_more
+
+    # Each page is sorted, so a k-way merge gives the first <limit> keys of the whole cluster
+    merged = list(heapq.merge(*pages, key=lambda item: item[0]))
+    more = more or len(merged) > limit
+    merged = merged[:limit]
+
+    if values:
+        items = [{"key": key, "value": value} for key, value in merged]
+    else:
+        items = [key for key, value in merged]
+    next_cursor = None
+    if more and merged:
+        next_cursor = base64.urlsafe_b64encode(merged[-1][0].encode()).decode()
+    # A scan reads no single key, so in per-key mode it adds nothing to the client's metadata
+    if PER_KEY:
+        return {"keys": items, "next-cursor": next_cursor}, 200
+    return {"keys": items, "next-cursor": next_cursor, "causal-metadata": VectorClock}, 200
+
+# Large Value APIs and Functions ============================================================
+CHUNK_SIZE = 64 * 1024
+
+def read_body():
+    """
+    Reads the raw request body in chunks straight into a single buffer without intermediate copies.
+    RETURN: A bytearray holding the body
+    """
+    stream = request.stream
+    length = request.content_length
+    if length is None:
+        # Chunked upload, so the final size is unknown
+        buf = bytearray()
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                return buf
+            buf += chunk
+
+    buf = bytearray(length)
+    view = memoryview(buf)
+    pos = 0
+    while pos < length:
+        read = stream.readinto(view[pos:pos + CHUNK_SIZE])
+        if not read:
+            break
+        pos += read
+    view.release()
+    if pos < length:
+        del buf[pos:]
+    return buf
+
+def iter_chunks(value, start=0, stop=None):
+    """
+    Yields memoryview slices of <value> between <start> and <stop>, CHUNK_SIZE bytes at a time.
+    """
+    view = memoryview(value)
+    stop = len(view) if stop is None else stop
+    for pos in range(start, stop, CHUNK_SIZE):
+        yield view[pos:min(pos + CHUNK_SIZE, stop)]
+
+def causal_header():
+    """
+    Returns the causal metadata sent in the X-Causal-Metadata header of a raw value request.
+    """
+    return json.loads(request.headers.get('X-Causal-Metadata') or 'null')
+
+@traced
+def blast_put_blob(key, value, from_rep):
+    """
+    Streams a raw value to every other replica in this replica's shard as a chunked upload, until each
+    has it or is declared down.
+
+    :param key: The key of the raw value
+    :param value: The bytes of the raw value
+    :param from_rep: The replica that originally received the request
+    """
+    to_remove = set()
+    for rep in shards[current_shard]:
+        if rep != MY_ADDRESS:
+            send_blob(rep, key, value, from_rep, to_remove)
+    for rep in to_remove:
+        View.remove(rep)
+        blast_delete(rep)
+
+def send_blob(rep, key, value, from_rep, to_remove):
+    """
+    Streams a raw value to the replica <rep> through replicate_write, restarting the upload on every retry.
+    RETURN: True if <rep> acknowledged the value
+    """
+    rep_url = f"http://{rep}/reptorep/raw/{key}/{from_rep}"
+    headers = {"X-Causal-Metadata": json.dumps(VectorClock), "X-Key-Version": json.dumps(KeyVersion.get(f"{key}/raw")),
+               "Content-Type": "application/octet-stream"}
+    send = lambda timeout: peer_session.put(rep_url, data=iter_chunks(value), headers=headers, timeout=timeout)
+    return replicate_write(rep, send, to_remove) is not None
+
+@traced
+def blast_delete_blob(key, from_rep):
+    """
+    Deletes a raw value at every other replica in this replica's shard, until each has deleted it
+    or is declared down.
+
+    :param key: The key of the raw value
+    :param from_rep: The replica that originally received the request
+    """
+    headers = {"X-Key-Version": json.dumps(KeyVersion.get(f"{key}/raw"))}
+    to_remove = set()
+    for rep in shards[current_shard]:
+        if rep != MY_ADDRESS:
+            rep_url = f"http://{rep}/reptorep/raw/{key}/{from_rep}"
+            replicate_write(rep, lambda timeout: peer_session.delete(rep_url, headers=headers, timeout=timeout),
+                            to_remove)
+    for rep in to_remove:
+        View.remove(rep)
+        blast_delete(rep)
+
+@traced
+def migrate_blobs():
+    """
+    Streams every raw value that the ring now assigns to another shard to that shard. A value is only
+    dropped here once a replica of its new shard has acknowledged it, so it is never lost in transit.
+    """
+    to_remove = set()
+    for key in list(BlobStore.keys()):
+        new_shard, hash_value = consistentRing.key_to_shard(key)
+        if new_shard != current_shard and new_shard in shards:
+            value = BlobStore[key]
+            delivered = [send_blob(rep, key, value, MY_ADDRESS, to_remove) for rep in shards[new_shard]]
+            if any(delivered):
+                BlobStore.pop(key, None)
+            else:
+                print(f"No replica of shard {new_shard} took the raw value of {key}; keeping it here")
+    for rep in to_remove:
+        View.remove(rep)
+        blast_delete(rep)
+
+@app.route('/kvs/<key>/raw', methods=['PUT'])
+def Put_Raw_at_Rep(key):
+    """
+    Handles a streamed upload of a raw value for <key>.
+    The body is the value itself and the causal metadata is sent in the X-Causal-Metadata header.
+
+    :param key: The key that is to be inserted
+    """
+    if len(key) > 50:
+        return {"error": "Key is too long"}, 400
+
+    # Stream the body through to the shard that owns this key
+    shard, hash_value = consistentRing.key_to_shard(key)
+    if shard != current_shard:
+        hotKeyCache.invalidate(key)
+        owner = peerLoad.least_loaded(shards[shard])
+        rep_url = f"http://{owner}/kvs/{key}/raw"
+        headers = {"X-Causal-Metadata": request.headers.get('X-Causal-Metadata', 'null'),
+                   "Content-Type": "application/octet-stream"}
+        body = iter(lambda: request.stream.read(CHUNK_SIZE), b"")
+        try:
+            res = peer_session.put(rep_url, data=body, headers=headers, timeout=2.5)
+            return Response(res.content, status=res.status_code, content_type=res.headers.get('Content-Type'))
+        except requests.exceptions.RequestException as e:
+            return {"error": "Shard that owns the key is unreachable"}, 503
+
+    VC_Incoming = causal_header()
+    if not PER_KEY and not LessThanOrEqualTo(VC_Incoming, VectorClock):
+        return {"error": "Causal dependencies not satisfied; try again later"}, 503
+
+    value = read_body()
+    VectorClock[MY_ADDRESS] = VectorClock[MY_ADDRESS] + 1
+    if PER_KEY:
+        new_version(VC_Incoming, f"{key}/raw")
+    blast_vc(key)
+    blast_put_blob(key, value, MY_ADDRESS)
+
+    created = key not in BlobStore
+    BlobStore[key] = value
+    changeFeed.append("put-raw", key, None, causal_metadata(None, f"{key}/raw"), MY_ADDRESS)
+    vc = causal_metadata(VC_Incoming, f"{key}/raw")
+    if created:
+        return {"result": "created", "causal-metadata": vc, "shard-id": current_shard}, 201
+    return {"result": "replaced", "causal-metadata": vc}, 200
+
+@app.route('/kvs/<key>/raw', methods=['GET'])
+def Get_Raw_at_Rep(key):
+    """
+    Streams the raw value of <key> back to the client, honoring an HTTP Range header.
+
+    :param key: The key to return the value of
+    """
+    shard, hash_value = consistentRing.key_to_shard(key)
+    if shard != current_shard:
+        owner = peerLoad.least_loaded(shards[shard])
+        rep_url = f"http://{owner}/kvs/{key}/raw"
+        headers = {name: request.headers[name] for name in ('X-Causal-Metadata', 'Range') if name in request.headers}
+        try:
+            res = peer_session.get(rep_url, headers=headers, stream=True, timeout=2.5)
+        except requests.exceptions.RequestException as e:
+            return {"error": "Shard that owns the key is unreachable"}, 503
+        passed = ('Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges', 'X-Causal-Metadata')
+        return Response(res.iter_content(CHUNK_SIZE), status=res.status_code,
+                        headers={name: res.headers[name] for name in passed if name in res.headers})
+
+    if not causally_ready(causal_header(), f"{key}/raw"):
+        return {"error": "Causal dependencies not satisfied; try again later"}, 503
+    if key not in BlobStore:
+        return {"error": "Key does not exist"}, 404
+
+    value = BlobStore[key]
+    length = len(value)
+    headers = {"Accept-Ranges": "bytes", "X-Causal-Metadata": json.dumps(causal_metadata(causal_header(), f"{key}/raw"))}
+    start, stop, status = 0, length, 200
+
+    if request.range is not None:
+        byte_range = request.range.range_for_length(length)
+        if byte_range is None:
+            return Response(status=416, headers={"Content-Range": f"bytes */{length}"})
+        start, stop = byte_range
+        headers["Content-Range"] = request.range.to_content_range_header(length)
+        status = 206
+
+    headers["Content-Length"] = str(stop - start)
+    body = (bytes(chunk) for chunk in iter_chunks(value, start, stop))
+    return Response(body, status=status, headers=headers, content_type="application/octet-stream")
+
+@app.route('/kvs/<key>/raw', methods=['DELETE'])
+def Delete_Raw_at_Rep(key):
+    """
+    Deletes the raw value of <key> from every replica of the shard that owns it.
+
+    :param key: The key to delete
+    """
+    shard, hash_value = consistentRing.key_to_shard(key)
+    if shard != current_shard:
+        hotKeyCache.invalidate(key)
+        owner = peerLoad.least_loaded(shards[shard])
+        rep_url = f"http://{owner}/kvs/{key}/raw"
+        headers = {"X-Causal-Metadata": request.headers.get('X-Causal-Metadata', 'null')}
+        try:
+            res = peer_session.delete(rep_url, headers=headers, timeout=2.5)
+            return Response(res.content, status=res.status_code, content_type=res.headers.get('Content-Type'))
+        except requests.exceptions.RequestException as e:
+            return {"error": "Shard that owns the key is unreachable"}, 503
+
+    if not PER_KEY and not LessThanOrEqualTo(causal_header(), VectorClock):
+        return {"error": "Causal dependencies not satisfied; try again later"}, 503
+    if key not in BlobStore:
+        return {"error": "Key not found"}, 404
+
+    del BlobStore[key]
+    VectorClock[MY_ADDRESS] += 1
+    if PER_KEY:
+        new_version(causal_header(), f"{key}/raw")
+    changeFeed.append("delete-raw", key, None, causal_metadata(None, f"{key}/raw"), MY_ADDRESS)
+    blast_vc(key)
+    blast_delete_blob(key, MY_ADDRESS)
+    return {"result": "deleted", "causal-metadata": causal_metadata(causal_header(), f"{key}/raw")}, 200
+
+@app.route('/reptorep/raw/<key>/<from_rep>', methods=['PUT'])
+def Rec_Raw_From_Rep(key, from_rep):
+    """
+    Receive a raw value streamed from another replica of this shard.
+
+    :param key: The key that we need to insert/update
+    :param from_rep: The replica that originally received this request
+    """
+    value = read_body()
+    version = json.loads(request.headers.get('X-Key-Version') or 'null')
+    if buffer_if_joining("put-raw", key, value, version, from_rep):
+        return {"result": "buffered", "causal-metadata": VectorClock}, 201
+    if not apply_version(f"{key}/raw", version):
+        return {"result": "skipped", "causal-metadata": VectorClock}, 200
+    created = key not in BlobStore
+    BlobStore[key] = value
+    changeFeed.append("put-raw", key, None, causal_metadata(None, f"{key}/raw"), from_rep)
+    return {"result": "created" if created else "replaced", "causal-metadata": VectorClock}, 201 if created else 200
+
+@app.route('/reptorep/raw/<key>/<from_rep>', methods=['DELETE'])
+def Rec_Raw_From_Rep_del(key, from_rep):
+    """
+    Handle a forwarded request to delete a raw value.
+    """
+    version = json.loads(request.headers.get('X-Key-Version') or 'null')
+    if not buffer_if_joining("delete-raw", key, None, version, from_rep) and apply_version(f"{key}/raw", version):
+        if BlobStore.pop(key, None) is not None:
+            changeFeed.append("delete-raw", key, None, causal_metadata(None, f"{key}/raw"), from_rep)
+    return {"result": "deleted", "causal-metadata": VectorClock}, 200
+
 # View Operations ===========================================================================
 @app.route('/view', methods=['PUT'])
 def create_new_replica():
@@ -594,6 +1417,7 @@ def delete_replica():
     return {"result": "deleted"}, 200
 
 
+@traced
 def blast_delete(replica_socket_address):
     """
     Broadcasts the delete of the replica given at <replica_socket_address>
@@ -604,7 +1428,7 @@ def blast_delete(replica_socket_address):
             data = {"socket-address": replica_socket_address}
             
             try:
-                res = requests.delete(rep_url, json=data, timeout=1)
+                res = peer_session.delete(rep_url, json=data, timeout=1)
 
                 # Testing lines only
                 if res.status_code == 200 or res.status_code == 404:
@@ -656,20 +1480,42 @@ def shard_members(id):
     else:
         return {"error": "Shard does not exist"}, 404
 
+@app.route('/shard/hot-keys', methods=['GET'])
+def get_hot_keys():
+    """
+    Returns the most read keys seen by this replica along with their estimated read counts.
+    """
+    return {"hot-keys": hotKeyCounter.top(20), "threshold": HOT_KEY_THRESHOLD}, 200
+
+@app.route('/shard/ring', methods=['GET'])
+def get_ring():
+    """
+    Returns the consistent hashing ring as plain JSON, along with the members of every shard,
+    so clients can compute key placement locally.
+    """
+    return {"ring": consistentRing.to_dict(), "shards": shards}, 200
+
 @app.route('/shard/key-count/<id>', methods=['GET'])
 def shard_key_count(id):
     """
     Returns the number of keys in shard <id>.
-    """
-    if id in shards.keys():
-        return {'shard-key-count': len(shard_value_map[id])}, 200
+    Our own shard is counted exactly, other shards are reported from their latest summary.
+    """
+    if id == current_shard:
+        return {'shard-key-count': len(Store)}, 200
+    elif id in shards.keys():
+        if id not in shard_summaries:
+            refresh_summaries()
+        return {'shard-key-count': shard_summaries.get(id, {}).get("key-count", 0)}, 200
     else:
         return {"error": "id not in shard keys"}, 404
     
 @app.route('/shard/add-member/<id>', methods=['PUT'])
 def shard_add_member(id):
     """
-    Adds a new member to the shard specified by <id> and syncs its data with all members of shard <id>.
+    Adds a new member to the shard specified by <id>.
+    Existing replicas only receive the membership change; the new member pulls a snapshot of
+    the shard's data from one of its peers by itself.
     """
     data = request.json
     node_port = data.get('socket-address')
@@ -680,20 +1526,21 @@ def shard_add_member(id):
     else:
         return {"error": "Either id or Node:Port doesn't exist"}, 404
 
+@traced
 def blast_add_member(id, node_port):
     """
-    Broadcasts the addition of a new member to all replicas in the initial replica's shard.
+    Broadcasts the addition of a new member to every replica, then tells the new member to join.
+    Existing replicas learn about the new member first so that writes made while it copies
+    the shard's snapshot are already replicated to it.
     """
-    global current_shard, Store, VectorClock, shards, shard_value_map, consistentRing
+    add_member(id, node_port)
     for rep in View:
+        if rep == MY_ADDRESS or rep == node_port:
+            continue
         rep_url = f"http://{rep}/shard/addmemberincoming"
-        
-        # Convert to json serializable format
-        mapping_as_list = {shard: list(value_set) for shard, value_set in shard_value_map.items()}
-        ring_encode = jsonpickle.encode(consistentRing)
-        data  = {"id": id, "node_port": node_port, "store": Store, "vc": VectorClock, "shards": shards, "mapping": mapping_as_list, "ring": ring_encode}
+        data = {"id": id, "node_port": node_port}
         try:
-            res = requests.put(rep_url, json=data, timeout=0.7)
+            res = peer_put(rep_url, data, timeout=0.7)
             if res.status_code == 201:
                 print("Success")
         except requests.exceptions.Timeout:
@@ -701,33 +1548,30 @@ def blast_add_member(id, node_port):
         except requests.exceptions.RequestException as e:
             print(f"We ran into a non-timeout error when sending a PUT request to {rep}")
 
+    rep_url = f"http://{node_port}/shard/join"
+    sources = [rep for rep in shards[id] if rep != node_port]
+    data = {"id": id, "shards": shards, "ring": consistentRing.to_dict(), "sources": sources}
+    try:
+        res = peer_put(rep_url, data, timeout=2)
+        if res.status_code == 202:
+            print(f"{node_port} is joining {id}")
+    except requests.exceptions.RequestException as e:
+        print(f"We could not tell {node_port} to join {id}")
+
+def add_member(id, node_port):
+    """
+    Adds <node_port> to the members of shard <id>.
+    """
+    if node_port not in shards[id]:
+        shards[id].append(node_port)
+
 @app.route('/shard/addmemberincoming', methods=['PUT'])
 def add_member_incoming():
     """
-    If not the new member: Adds member to my list of replicas in each shard.
-    If new member: Initialize my values to be in sync with replicas in my assgined shard.
+    Adds the new member to my list of replicas in its shard.
     """
-    global current_shard
     data = request.json
-    node_port = data.get('node_port')
-    id = data.get('id')
-    store = data.get('store')
-    vc = data.get('VectorClock')
-    shard_set = data.get('shards')
-    mapping = data.get('mapping')
-    ring = data.get('ring')
-
-    if node_port == MY_ADDRESS:
-        global Store, VectorClock, shards, shard_value_map, consistentRing
-        current_shard = id
-        Store = store
-        VectorClock = vc
-        shards = shard_set
-        shard_value_map = {shard: set(value_list) for shard, value_list in mapping.items()}
-        consistentRing = jsonpickle.decode(ring)
-    
-    shards[id].append(node_port)
-
+    add_member(data.get('id'), data.get('node_port'))
     return {"result": "incoming done"}, 201
 
 @app.route('/shard/reshard', methods=['PUT'])
@@ -739,7 +1583,7 @@ def reshard():
     - Performs a rehash of all its key-value pairs and tells all replicas to do the same.
     - Sends out rehash results and tells all replicas to do the same.
     """
-    global Store, shards, shard_value_map, current_shard, consistentRing
+    global Store, shards, current_shard, consistentRing
     data = request.json
     new_shard_count = data.get('shard-count')
         
@@ -759,7 +1603,7 @@ def reshard():
             rep_url = f"http://{rep}/shard/blast_reshard"
             data = {"shards": new_shards, "ring": ring}
             try:
-                res = requests.put(rep_url, json=data, timeout=1.5)
+                res = peer_put(rep_url, data, timeout=1.5)
                 if res.status_code == 200:
                     print("Success")
             except requests.exceptions.Timeout:
@@ -768,33 +1612,41 @@ def reshard():
                 print(f"We ran into a non-timeout error when sending a RESHARD request to {rep}")
 
     # Now remap all the kv-pairs and prepare to receive new kv-pairs
-    if Store != {}:
-        my_remapping = rehash(Store)
-        Store = {}
-        
-        for shard, pairs in my_remapping.items():
-            for rep in View:
-                if rep != MY_ADDRESS:
-                    rep_url = f"http://{rep}/reptorep/remap"
-                    try:
-                        res = requests.put(rep_url, timeout=4)
-                        if res.status_code == 200:
-                            print("Success")
-                    except requests.exceptions.Timeout:
-                        print(f"A UPDATE STORE request to {rep} timed out")
-                    except requests.exceptions.RequestException as e:
-                        print(f"We ran into a non-timeout error when sending a UPDATE STORE request to {rep}")
-            for rep2 in shards[shard]:
-                rep_url = f"http://{rep2}/reptorep/updated_store"
-                data = {'new-store': pairs}
-                try:
-                    res = requests.put(rep_url, json=data, timeout=1.5)
-                    if res.status_code == 200:
-                        print("Success")
-                except requests.exceptions.Timeout:
-                    print(f"A UPDATE STORE request to {rep} timed out")
-                except requests.exceptions.RequestException as e:
-                    print(f"We ran into a non-timeout error when sending a UPDATE STORE request to {rep}")                    
+    my_remapping = rehash(Store) if Store != {} else {}
+    Store = {}
+    keyIndex.rebuild(Store)
+    shardSummary.invalidate()
+
+    # Every other replica remaps its own kv-pairs and raw values, whatever this replica holds
+    for rep in View:
+        if rep != MY_ADDRESS:
+            rep_url = f"http://{rep}/reptorep/remap"
+            try:
+                res = peer_session.put(rep_url, timeout=4)
+                if res.status_code == 200:
+                    print("Success")
+            except requests.exceptions.Timeout:
+                print(f"A UPDATE STORE request to {rep} timed out")
+            except requests.exceptions.RequestException as e:
+                print(f"We ran into a non-timeout error when sending a UPDATE STORE request to {rep}")
+
+    # Raw values go first so they arrive before their versions, which would otherwise make them look stale
+    migrate_blobs()
+    moved_versions = take_moved_versions()
+
+    # Shards that only gain deleted keys still get their versions
+    for shard in set(my_remapping) | set(moved_versions):
+        for rep2 in shards[shard]:
+            rep_url = f"http://{rep2}/reptorep/updated_store"
+            data = {'new-store': my_remapping.get(shard, {}), 'versions': moved_versions.get(shard, {})}
+            try:
+                res = peer_put(rep_url, data, timeout=1.5)
+                if res.status_code == 200:
+                    print("Success")
+            except requests.exceptions.Timeout:
+                print(f"A UPDATE STORE request to {rep2} timed out")
+            except requests.exceptions.RequestException as e:
+                print(f"We ran into a non-timeout error when sending a UPDATE STORE request to {rep2}")
 
     return {"result": "resharded"}, 200
 
@@ -805,13 +1657,14 @@ def blasted_reshard():
     """
     Updates the shard members for all replicas that did not initiate the reshard.
     """
-    global Store, shards, shard_value_map, current_shard, consistentRing
+    global Store, shards, current_shard, consistentRing
     data = request.json
     shards = data.get('shards')
     for shard, reps in shards.items():
         if MY_ADDRESS in reps:
             current_shard = shard
-        shard_value_map[shard] = set()
+    shard_summaries.clear()
+    summary_pending.clear()
     consistentRing = jsonpickle.decode(data.get('ring'))
 
     return {"result": "resharded"}, 200
@@ -822,24 +1675,30 @@ def update_store():
     Rehashes the key-value store, then sends the pairs to their new correct shard location.
     """
     global Store
+    my_remapping = {}
     if Store != {}:
         my_remapping = rehash(Store)
         Store = {}
+        keyIndex.rebuild(Store)
+        shardSummary.invalidate()
         time.sleep(1)
-
-        for shard, pairs in my_remapping.items():
-            shard_to_send = shards[shard]
-            for rep in shard_to_send:
-                rep_url = f"http://{rep}/reptorep/updated_store"
-                data = {'new-store': pairs}
-                try:
-                    res = requests.put(rep_url, json=data, timeout=1)
-                    if res.status_code == 200:
-                        print("Success")
-                except requests.exceptions.Timeout:
-                    print(f"A UPDATE STORE request to {rep} timed out")
-                except requests.exceptions.RequestException as e:
-                    print(f"We ran into a non-timeout error when sending a UPDATE STORE request to {rep}")
+    migrate_blobs()
+    moved_versions = take_moved_versions()
+
+    # Shards that only gain deleted keys still get their versions
+    for shard in set(my_remapping) | set(moved_versions):
+        shard_to_send = shards[shard]
+        for rep in shard_to_send:
+            rep_url = f"http://{rep}/reptorep/updated_store"
+            data = {'new-store': my_remapping.get(shard, {}), 'versions': moved_versions.get(shard, {})}
+            try:
+                res = peer_put(rep_url, data, timeout=1)
+                if res.status_code == 200:
+                    print("Success")
+            except requests.exceptions.Timeout:
+                print(f"A UPDATE STORE request to {rep} timed out")
+            except requests.exceptions.RequestException as e:
+                print(f"We ran into a non-timeout error when sending a UPDATE STORE request to {rep}")
     return {"result": "successful remap"}, 200
 
 @app.route('/reptorep/updated_store', methods=['PUT'])
@@ -850,55 +1709,599 @@ def updated_store():
     global Store
     data = request.json
     Store.update(data.get('new-store'))
+    merge_versions(data.get('versions') or {})
+    keyIndex.rebuild(Store)
+    shardSummary.invalidate()
 
     return {"result": "update successful"}, 200
 
-@app.route('/reptorep/updated_map', methods=['PUT'])
-def updated_map():
-    """
-    Updates its map of what shard's hold which keys.
-    """
-    global shard_value_map
-    data = request.json
-    new_map = jsonpickle.decode(data.get('new-map'))
-
-    # Merge the new data with the existing values
-    for shard, keys in new_map.items():
-        if keys != set():
-            shard_value_map[shard].update(keys)
-
-    return {"result": "Update Succesful"}, 200
-
+@traced
 def rehash(store):
     """
     Uses consistent hashing to re-determine the shard location for each key.
-    Creates and broadcasts to every replica a new mapping of keys to shards.
+    Other replicas learn about the new key locations from the shard summaries they refresh.
     Returns a defaultdict(dict) object with every shard as the key holding key-value pairs
     """
-    global shards, shard_value_map
     # Use a defaultdict so every shard gets a dictionary of key value pairs
     new_mapping = defaultdict(dict)
         
     for key, value in store.items():
         new_shard, hash_value = consistentRing.key_to_shard(key)
         new_mapping[new_shard][key] = value
-        shard_value_map[new_shard].add(key)
+    shard_summaries.clear()
+    summary_pending.clear()
+
+    return dict(new_mapping)
+
+
+# Metrics APIs ===============================================================================
+@app.route('/debug/traces', methods=['GET'])
+def get_traces():
+    """
+    Returns recently sampled traces along with duration aggregates per stage and per peer.
+    A single trace can be requested with ?trace-id=<id>.
+    """
+    limit = request.args.get('limit', 20, type=int)
+    return tracer.report(request.args.get('trace-id'), limit), 200
+
+PROFILE_MAX_SECONDS = 30
+PROFILE_MIN_INTERVAL = 0.001                    # Shorter intervals would keep a core busy sampling
+
+@app.route('/debug/profile', methods=['GET'])
+def get_profile():
+    """
+    Samples the stacks of this replica's threads for ?seconds=<n> (0 to 30) every ?interval=<n> seconds
+    (at least PROFILE_MIN_INTERVAL and at most <seconds>) and returns the most common.
+    """
+    # The bound goes first so that a NaN argument is replaced by it
+    seconds = min(PROFILE_MAX_SECONDS, max(0, request.args.get('seconds', 5, type=float)))
+    interval = max(PROFILE_MIN_INTERVAL, min(max(seconds, PROFILE_MIN_INTERVAL), request.args.get('interval', 0.005, type=float)))
+    return sample_profile(seconds, interval), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Returns the byte counts of replica-to-replica messages before and after compression,
+    and the admission budgets of this replica along with the load its peers last reported.
+    """
+    return {"compression": compressionStats.snapshot(), "peer-codecs": peer_codecs,
+            "admission": {"client": clientBudget.snapshot(), "peer": peerBudget.snapshot(),
+                          "replication": replicationBudget.snapshot()},
+            "peer-load": peerLoad.snapshot()}, 200
+
+# Rebalance APIs and Functions ===============================================================
+@app.route('/shard/load', methods=['GET'])
+def get_load():
+    """
+    Returns the key count, bytes of values and raw values, and client request rate of this replica.
+    The request rate covers the last REQUEST_RATE_WINDOW seconds, or the uptime if that is shorter.
+    """
+    now = time.time()
+    with requestLock:
+        served = sum(count for second, count in request_buckets if second > now - REQUEST_RATE_WINDOW)
+    rate = served / max(min(now - load_window_start, REQUEST_RATE_WINDOW), 0.001)
+
+    value_bytes = sum(len(str(key)) + len(str(value)) for key, value in Store.items())
+    value_bytes += sum(len(key) + len(value) for key, value in BlobStore.items())
+    return {"shard": current_shard, "key-count": len(Store), "bytes": value_bytes, "request-rate": rate}, 200
+
+@traced
+def gather_shard_stats():
+    """
+    Asks every replica for its load and combines the answers per shard.
+    Key counts and bytes are taken from the most complete replica, request rates are summed.
+    RETURN: A dict of shard -> {"key-count", "bytes", "request-rate"}
+    """
+    stats = {shard: {"key-count": 0, "bytes": 0, "request-rate": 0} for shard in shards}
+    for shard, reps in shards.items():
+        for rep in reps:
+            rep_url = f"http://{rep}/shard/load"
+            try:
+                res = peer_session.get(rep_url, timeout=1)
+                if res.status_code == 200:
+                    load = res.json()
+                    stats[shard]["key-count"] = max(stats[shard]["key-count"], load.get("key-count", 0))
+                    stats[shard]["bytes"] = max(stats[shard]["bytes"], load.get("bytes", 0))
+                    stats[shard]["request-rate"] += load.get("request-rate", 0)
+            except requests.exceptions.Timeout:
+                print(f"A LOAD request to {rep} timed out")
+            except requests.exceptions.RequestException as e:
+                print(f"We ran into a non-timeout error when sending a LOAD request to {rep}")
+    return stats
+
+@app.route('/shard/rebalance', methods=['PUT'])
+def rebalance():
+    """
+    Moves virtual shards from overloaded shards to underloaded shards.
+    Process:
+    - Uses the weights given by the client, or plans new weights from the load of every shard.
+    - Applies the weights and broadcasts them so every replica applies them too.
+    - Every replica sends only the keys whose owner changed to their new shard.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return {"error": "Request body must be a JSON object"}, 400
+    weights = data.get('weights')
+    ratio = None
+
+    if weights is None:
+        stats = gather_shard_stats()
+        ratio = load_ratio(shard_loads(stats))
+        weights = plan_rebalance(stats, consistentRing.shard_weights)
+    elif not isinstance(weights, dict):
+        return {"error": "Weights must map shards to positive integers"}, 400
+    elif any(shard not in shards or not isinstance(weight, int) or isinstance(weight, bool) or weight < 1 for shard, weight in weights.items()):
+        return {"error": "Weights must be positive integers for existing shards"}, 400
 
     for rep in View:
         if rep != MY_ADDRESS:
-            rep_url = f"http://{rep}/reptorep/updated_map"
-            data = {'new-map': jsonpickle.encode(shard_value_map)}
+            rep_url = f"http://{rep}/shard/blast_weights"
             try:
-                res = requests.put(rep_url, json=data, timeout=1)
+                res = peer_put(rep_url, {"weights": weights}, timeout=1.5)
                 if res.status_code == 200:
-                    print("Successful Mapping Update")
+                    print("Success")
             except requests.exceptions.Timeout:
-                print(f"A UPDATE MAP request to {rep} timed out")
+                print(f"A WEIGHTS request to {rep} timed out")
             except requests.exceptions.RequestException as e:
-                print(f"We ran into a non-timeout error when sending a UPDATE MAP request to {rep}")
+                print(f"We ran into a non-timeout error when sending a WEIGHTS request to {rep}")
+    apply_weights(weights)
 
-    return dict(new_mapping)
+    return {"result": "rebalanced", "weights": consistentRing.shard_weights, "load-ratio": ratio}, 200
+
+@app.route('/shard/blast_weights', methods=['PUT'])
+def blasted_weights():
+    """
+    Applies the virtual shard weights chosen by the replica that started the rebalance.
+    """
+    data = request.json
+    apply_weights(data.get('weights'))
+    return {"result": "rebalanced"}, 200
+
+@traced
+def apply_weights(weights):
+    """
+    Reweights the ring and migrates the keys whose owner changed.
+
+    :param weights: A dict of shard -> new number of virtual shards
+    """
+    global Store
+    for shard, weight in weights.items():
+        consistentRing.set_shard_weight(shard, weight)
 
+    # Keys moved between shards, so the summaries are rebuilt on the next refresh
+    shard_summaries.clear()
+    summary_pending.clear()
+
+    # Take the moved pairs out of our store and send them to their new shard
+    moved = defaultdict(dict)
+    for key in list(Store.keys()):
+        new_shard, hash_value = consistentRing.key_to_shard(key)
+        if new_shard != current_shard:
+            moved[new_shard][key] = Store.pop(key)
+    keyIndex.rebuild(Store)
+    shardSummary.invalidate()
+    migrate_blobs()
+    moved_versions = take_moved_versions()
+
+    # Shards that only gain deleted keys still get their versions
+    for shard in set(moved) | set(moved_versions):
+        for rep in shards[shard]:
+            rep_url = f"http://{rep}/reptorep/updated_store"
+            data = {'new-store': moved.get(shard, {}), 'versions': moved_versions.get(shard, {})}
+            try:
+                res = peer_put(rep_url, data, timeout=1.5)
+                if res.status_code == 200:
+                    print("Success")
+            except requests.exceptions.Timeout:
+                print(f"A UPDATE STORE request to {rep} timed out")
+            except requests.exceptions.RequestException as e:
+                print(f"We ran into a non-timeout error when sending a UPDATE STORE request to {rep}")
+
+
+# Shard Summary APIs and Functions ===========================================================
+SUMMARY_REFRESH_INTERVAL = 2
+
+@app.route('/shard/summary', methods=['GET'])
+def get_summary():
+    """
+    Returns a Bloom filter of the keys in this replica's shard along with the exact key count.
+    The filter is kept up to date as keys are written rather than rebuilt on every request.
+    If the requester already holds a filter with the given digest, the filter is left out.
+    """
+    digest, bloom = shardSummary.summarize(lambda: list(Store.keys()), request.args.get('digest'))
+    summary = {"shard": current_shard, "key-count": len(Store), "digest": digest}
+    if bloom is not None:
+        summary["filter"] = bloom
+    return summary, 200
+
+def might_contain(shard, key):
+    """
+    Returns False only if the summary of <shard> shows that <key> is definitely not stored there.
+    Shards without a summary yet are assumed to possibly hold the key.
+    """
+    summary = shard_summaries.get(shard)
+    return summary is None or key in summary["filter"]
+
+@traced
+def refresh_summaries():
+    """
+    Fetches the latest summary of every other shard from one of its members.
+    """
+    for shard, reps in list(shards.items()):
+        if shard == current_shard:
+            continue
+        known = shard_summaries.get(shard)
+        pending = summary_pending.pop(shard, set())
+        for rep in reps:
+            rep_url = f"http://{rep}/shard/summary"
+            params = {"digest": known["digest"]} if known is not None else {}
+            try:
+                res = peer_session.get(rep_url, params=params, timeout=1)
+                if res.status_code != 200:
+                    continue
+                data = res.json()
+                if data.get("shard") != shard:
+                    continue
+                if "filter" in data:
+                    bloom = BloomFilter.from_dict(data["filter"])
+                elif known is not None:
+                    bloom = known["filter"]
+                else:
+                    continue
+                # Keys created while the summary was in flight may be missing from it
+                for key in pending | summary_pending[shard]:
+                    bloom.add(key)
+                shard_summaries[shard] = {"filter": bloom, "key-count": data["key-count"], "digest": data["digest"]}
+                break
+            except requests.exceptions.RequestException as e:
+                continue
+
+def refresh_summaries_forever():
+    """
+    Keeps the summaries of other shards fresh in the background.
+    """
+    while True:
+        time.sleep(SUMMARY_REFRESH_INTERVAL)
+        try:
+            refresh_summaries()
+        except Exception as e:
+            print(f"Refreshing shard summaries failed: {e}")
+
+if not SIMULATION:
+    threading.Thread(target=refresh_summaries_forever, daemon=True).start()
+
+
+# Change Feed APIs and Functions =============================================================
+CHANGE_FEED_KEEPALIVE = 15                      # Seconds between keep-alive comments on an idle stream
+CHANGE_FEED_MAX_LIMIT = 1000                    # Most events returned in one batch
+
+@app.route('/shard/changes', methods=['GET'])
+def stream_changes():
+    """
+    Streams the PUTs and DELETEs applied by this replica, in the order it applied them, as Server-Sent Events.
+    Each event's id is its offset, so a consumer resumes with ?offset=<n> or the Last-Event-ID header
+    of a reconnecting EventSource. Without either, only writes made from now on are streamed.
+    Offsets are assigned by each replica on its own, so every response names this replica; a consumer that
+    passes the replica its offset came from as ?replica= gets a 409 from any other replica instead of wrong events.
+    With ?format=json a single batch of up to ?limit= events (1 to CHANGE_FEED_MAX_LIMIT) is returned instead of a stream.
+    """
+    replica = request.args.get('replica')
+    if replica is not None and replica != MY_ADDRESS:
+        return {"error": "Offsets of another replica's change feed cannot be resumed here", "replica": MY_ADDRESS}, 409
+
+    try:
+        last_event_id = request.headers.get('Last-Event-ID')
+        if last_event_id is not None:
+            offset = int(last_event_id) + 1
+        else:
+            offset = int(request.args.get('offset', changeFeed.next_offset))
+        limit = min(max(1, int(request.args.get('limit', 100))), CHANGE_FEED_MAX_LIMIT)
+    except ValueError:
+        return {"error": "offset and limit must be integers"}, 400
+
+    if changeFeed.read(offset, limit=0) is None:
+        return {"error": "Offset has been evicted from the change feed", "first-offset": changeFeed.first_offset(),
+                "replica": MY_ADDRESS}, 410
+
+    if request.args.get('format') == 'json':
+        events = changeFeed.read(offset, limit) or []
+        next_offset = events[-1]["offset"] + 1 if events else offset
+        return {"shard-id": current_shard, "replica": MY_ADDRESS, "events": events, "next-offset": next_offset}, 200
+
+    def events(offset):
+        yield "retry: 1000\n\n"
+        while True:
+            batch = changeFeed.read(offset, limit, timeout=CHANGE_FEED_KEEPALIVE)
+            if batch is None:
+                # The consumer fell further behind than the feed keeps; it gets a 410 when it reconnects
+                yield f"event: evicted\ndata: {json.dumps({'first-offset': changeFeed.first_offset()})}\n\n"
+                return
+            if not batch:
+                yield ": keep-alive\n\n"
+                continue
+            for event in batch:
+                yield f"id: {event['offset']}\nevent: {event['op']}\ndata: {json.dumps(event)}\n\n"
+            offset = batch[-1]["offset"] + 1
+
+    return Response(events(offset), content_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Replica": MY_ADDRESS})
+
+
+# Shard Join APIs and Functions ==============================================================
+joining = current_shard is not None             # True while this replica catches up at startup or copies a snapshot of a new shard
+join_log = []                                   # Writes replicated to this replica while it was joining
+joinLock = threading.Lock()
+JOIN_RETRY = 0.5                                # Seconds before the snapshot is first retried, doubled on each retry
+JOIN_MAX_RETRY = 4
+JOIN_DEADLINE = 30                              # Seconds of retrying before the join is given up
+
+@app.route('/shard/snapshot', methods=['GET'])
+def send_snapshot():
+    """
+    Streams a point-in-time copy of this replica's data as newline delimited JSON.
+    The first line holds the vector clock and whether this replica is ready, then one line per key-value pair
+    and raw value, then one line per key version (per-key mode), then an end marker.
+    A requester given as ?replica=<address> is added to the View before the copy is taken, so every write
+    applied after the copy is also replicated to it.
+    The stream is deflated when the requester accepts it, since compress_response leaves streams alone.
+    """
+    replica = request.args.get('replica')
+    if replica is not None and replica not in View:
+        View.add(replica)
+        VectorClock.setdefault(replica, 0)
+    store, blobs, vc, versions = dict(Store), dict(BlobStore), dict(VectorClock), dict(KeyVersion)
+    ready = startup["ready"]
+
+    def lines():
+        yield json.dumps({"type": "header", "vc": vc, "keys": len(store), "raw-keys": len(blobs),
+                          "ready": ready}) + "\n"
+        for key, value in store.items():
+            yield json.dumps({"type": "kv", "key": key, "value": value}) + "\n"
+        for key, value in blobs.items():
+            yield json.dumps({"type": "raw", "key": key, "value": base64.b64encode(value).decode()}) + "\n"
+        for key, version in versions.items():
+            yield json.dumps({"type": "version", "key": key, "version": version}) + "\n"
+        yield json.dumps({"type": "end"}) + "\n"
+
+    if 'deflate' in request.headers.get('Accept-Encoding', ''):
+        body = deflate_stream((line.encode() for line in lines()), compressionStats)
+        return Response(body, content_type="application/x-ndjson",
+                        headers={"Content-Encoding": "deflate", "Vary": "Accept-Encoding"})
+    return Response(lines(), content_type="application/x-ndjson")
+
+@app.route('/shard/join', methods=['PUT'])
+def join_shard():
+    """
+    Makes this replica a member of the shard <id> given in the request.
+    Stops serving clients, then pulls a snapshot from one of the shard's members in the background.
+    """
+    global current_shard, shards, consistentRing, joining
+    data = request.json
+    try:
+        ring = ConsistentRing.from_dict(data.get('ring'))
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return {"error": "Invalid ring"}, 400
+    with joinLock:
+        joining = True
+        join_log.clear()
+    startup["ready"] = False
+    startup["join"] = "joining"
+    current_shard = data.get('id')
+    shards = data.get('shards')
+    consistentRing = ring
+    shard_summaries.clear()
+    summary_pending.clear()
+
+    if SIMULATION:
+        pull_snapshot(data.get('sources'))
+    else:
+        threading.Thread(target=pull_snapshot, args=(data.get('sources'),), daemon=True).start()
+    return {"result": "joining"}, 202
+
+def buffer_if_joining(op, key, value=None, version=None, origin=None):
+    """
+    Records a replicated write to be replayed after the snapshot if this replica is catching up or joining a shard.
+
+    :param op: One of "put", "delete", "put-raw", or "delete-raw"
+    :param key: The key that was written
+    :param value: The value that was written, if any
+    :param version: The version of the write, in per-key mode
+    :param origin: The replica that received the write from the client
+    RETURN: True if the write was buffered and must not be applied now
+    """
+    with joinLock:
+        if joining:
+            join_log.append((op, key, value, version, origin))
+        return joining
+
+def open_snapshot(rep, timeout=5):
+    """
+    Starts streaming the snapshot of the replica <rep> from /shard/snapshot and reads its header line.
+    RETURN: The streaming response, an iterator over its remaining lines, and the header,
+            or None if <rep> did not send a header
+    """
+    res = peer_session.get(f"http://{rep}/shard/snapshot", params={"replica": MY_ADDRESS}, stream=True, timeout=timeout)
+    lines = res.iter_lines()
+    header = json.loads(next(lines, b'null')) if res.status_code == 200 else None
+    if not isinstance(header, dict) or header.get("type") != "header":
+        res.close()
+        return None
+    return res, lines, header
+
+def close_snapshot(future, chosen):
+    """
+    Closes the snapshot stream opened by <future> unless it is the <chosen> one.
+    """
+    if future.cancelled() or future.exception() is not None:
+        return
+    opened = future.result()
+    if opened is not None and opened is not chosen:
+        opened[0].close()
+
+def read_snapshot(rep, timeout=5):
+    """
+    Streams the snapshot of the replica <rep> from /shard/snapshot.
+    RETURN: A dict with the "store", "blobs", "vc", and "versions" of <rep> and whether it is "ready",
+            or None if the stream was incomplete
+    """
+    opened = open_snapshot(rep, timeout)
+    if opened is None:
+        return None
+    res, lines, header = opened
+    with res:
+        return read_snapshot_body(lines, header)
+
+def read_snapshot_body(lines, header):
+    """
+    Reads the rest of a snapshot stream after its <header>.
+    RETURN: The snapshot as returned by read_snapshot, or None if the stream ended before its end marker
+    """
+    store, blobs, versions = {}, {}, {}
+    for line in lines:
+        entry = json.loads(line)
+        if entry["type"] == "kv":
+            store[entry["key"]] = entry["value"]
+        elif entry["type"] == "raw":
+            blobs[entry["key"]] = bytearray(base64.b64decode(entry["value"]))
+        elif entry["type"] == "version":
+            versions[entry["key"]] = entry["version"]
+        elif entry["type"] == "end":
+            return {"store": store, "blobs": blobs, "vc": header["vc"], "versions": versions, "ready": header["ready"]}
+    return None
+
+def install_snapshot(snapshot):
+    """
+    Replaces this replica's data with <snapshot>, replays the writes buffered while it was copied, and
+    stops buffering. Buffered writes are newer than the snapshot, unless their version shows the snapshot
+    already holds a later write (per-key mode).
+    RETURN: The number of buffered writes
+    """
+    global Store, BlobStore, joining
+    with joinLock:
+        Store, BlobStore = snapshot['store'], snapshot['blobs']
+        vc = snapshot['vc']
+        for rep_vc in set(VectorClock.keys()).union(vc.keys()):
+            VectorClock[rep_vc] = max(VectorClock.get(rep_vc, 0), vc.get(rep_vc, 0))
+        merge_versions(snapshot['versions'])
+        for op, key, value, version, origin in join_log:
+            versioned_key = key if op in ("put", "delete") else f"{key}/raw"
+            if not apply_version(versioned_key, version):
+                continue
+            if op == "put":
+                Store[key] = value
+            elif op == "delete":
+                Store.pop(key, None)
+            elif op == "put-raw":
+                BlobStore[key] = value
+            elif op == "delete-raw":
+                BlobStore.pop(key, None)
+            # Raw values are left out of the feed, consumers read them from /kvs/<key>/raw
+            changeFeed.append(op, key, value if op == "put" else None, causal_metadata(None, versioned_key), origin)
+        keyIndex.rebuild(Store)
+        shardSummary.invalidate()
+        buffered = len(join_log)
+        join_log.clear()
+        joining = False
+    return buffered
+
+@traced
+def pull_snapshot(sources):
+    """
+    Copies a snapshot of the shard from the first source that streams one completely, replays
+    the writes buffered meanwhile, and then starts serving clients. Retries with backoff, and gives up
+    once it has waited JOIN_DEADLINE seconds, leaving the replica unready with the join marked failed.
+
+    :param sources: The other members of the shard
+    RETURN: True if the replica joined the shard, False if the join failed
+    """
+    global joining
+    delay, waited = JOIN_RETRY, 0
+    while True:
+        for rep in sources:
+            try:
+                snapshot = read_snapshot(rep)
+            except requests.exceptions.RequestException as e:
+                print(f"We could not stream a snapshot from {rep}")
+                continue
+            if snapshot is None:
+                continue
+            buffered = install_snapshot(snapshot)
+            print(f"Joined {current_shard} with {len(Store)} keys, replayed {buffered} writes")
+            startup["join"] = "joined"
+            startup["ready"] = True
+            return True
+        if waited >= JOIN_DEADLINE:
+            break
+        time.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, JOIN_MAX_RETRY)
+
+    # A later /shard/join copies a fresh snapshot, so the buffered writes are not needed
+    with joinLock:
+        join_log.clear()
+        joining = False
+    startup["join"] = "failed"
+    print(f"Could not copy a snapshot of {current_shard} from any of {sources}, the join failed")
+    return False
+
+
+# Startup APIs and Functions =================================================================
+startup = {"ready": False, "view-size": len(View), "phases": {}, "startup-seconds": None, "catch-up-retries": 0,
+           "join": None}
+CATCH_UP_RETRY = 0.5                            # Seconds before catch-up is first retried, doubled on each retry
+CATCH_UP_MAX_RETRY = 8
+
+@app.before_request
+def require_ready():
+    """
+    Turns away client requests until this replica has announced itself and caught up with its shard.
+    """
+    if not startup["ready"] and request.path.startswith('/kvs'):
+        if startup["join"] == "failed":
+            return {"error": "Replica failed to join its shard"}, 503
+        return {"error": "Replica is starting up; try again later"}, 503, {"Retry-After": "1"}
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    """
+    Returns 200 once this replica is ready to serve clients, 503 before that.
+    Also reports how long each startup phase took for the size of the View, and the state of the
+    last shard join ("joining", "joined", or "failed").
+    """
+    return startup, 200 if startup["ready"] else 503
+
+def bootstrap():
+    """
+    Announces this replica to the View and catches up with its shard at the same time.
+    Each phase has a bounded deadline, so down replicas only delay startup by that deadline. Catch-up is
+    retried with backoff until it succeeds, and this replica only becomes ready afterwards.
+    """
+    start = time.perf_counter()
+
+    def timed(name, func):
+        phase_start = time.perf_counter()
+        func()
+        startup["phases"][name] = round(time.perf_counter() - phase_start, 3)
+
+    announce = threading.Thread(target=timed, args=("announce", lambda: blast_add(MY_ADDRESS)))
+    def catch_up():
+        delay = CATCH_UP_RETRY
+        while not get_info():
+            startup["catch-up-retries"] += 1
+            print(f"Could not catch up with {current_shard}, retrying in {delay}s")
+            time.sleep(delay)
+            delay = min(delay * 2, CATCH_UP_MAX_RETRY)
+
+    announce.start()
+    timed("catch-up", catch_up)
+    announce.join()
+
+    startup["startup-seconds"] = round(time.perf_counter() - start, 3)
+    startup["ready"] = True
+    print(f"Ready after {startup['startup-seconds']}s with a View of {startup['view-size']} replicas")
+
+if not SIMULATION:
+    threading.Thread(target=bootstrap, daemon=True).start()
 
 
 #Main =====================================================================
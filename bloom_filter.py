@@ -0,0 +1,111 @@
+import base64
+import hashlib
+import threading
+
+class BloomFilter:
+    def __init__(self, num_bits=2**20, num_hashes=5, bits=None):
+        """
+        Initializes a fixed size Bloom filter.
+        A lookup that returns False means the key was definitely never added; True means it may have been.
+        The size does not grow with the number of keys, only the false positive rate does.
+
+        :param num_bits: The number of bits in the filter
+        :param num_hashes: The number of bit positions set for each key
+        :param bits: Existing filter contents, used when decoding a filter sent by another replica
+        """
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray(num_bits // 8)
+
+    def _positions(self, key):
+        """
+        Yields the bit positions of <key> using double hashing over a single sha256 digest.
+        """
+        digest = hashlib.sha256(key.encode()).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key):
+        """
+        Adds <key> to the filter.
+        """
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def digest(self):
+        """
+        Returns a short fingerprint of the filter contents so unchanged filters need not be resent.
+        """
+        return hashlib.sha256(self.bits).hexdigest()[:16]
+
+    def to_dict(self):
+        """
+        Returns a JSON serializable form of the filter.
+        """
+        return {"num-bits": self.num_bits, "num-hashes": self.num_hashes,
+                "bits": base64.b64encode(self.bits).decode()}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuilds a filter from the output of to_dict.
+        """
+        return cls(data["num-bits"], data["num-hashes"], bytearray(base64.b64decode(data["bits"])))
+
+    @classmethod
+    def from_keys(cls, keys, num_bits=2**20, num_hashes=5):
+        """
+        Builds a filter holding every key in <keys>.
+        """
+        bloom = cls(num_bits, num_hashes)
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+class ShardSummary:
+    def __init__(self):
+        """
+        Initializes the Bloom filter and digest of the keys in this replica's own shard.
+        New keys are added to the filter as they are written; deletes and bulk changes only mark the
+        filter stale, and it is rebuilt the next time it is read.
+        """
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.digest = None
+
+    def add(self, key):
+        """
+        Adds a newly written <key> to the filter, if it is currently built.
+        """
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(key)
+                self.digest = None
+
+    def invalidate(self):
+        """
+        Marks the filter stale after a key was removed or the keys changed in bulk.
+        """
+        with self.lock:
+            self.bloom = None
+            self.digest = None
+
+    def summarize(self, keys, known_digest=None):
+        """
+        Returns the digest of the filter, and the filter itself unless the requester already holds it.
+
+        :param keys: A function returning the current keys, called only if the filter must be rebuilt
+        :param known_digest: The digest of the filter the requester holds
+        RETURN: The digest, and the filter as a dict or None
+        """
+        with self.lock:
+            if self.bloom is None:
+                self.bloom = BloomFilter.from_keys(keys())
+            if self.digest is None:
+                self.digest = self.bloom.digest()
+            return self.digest, (self.bloom.to_dict() if known_digest != self.digest else None)
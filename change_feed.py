@@ -0,0 +1,85 @@
+"""
+The change feed of a replica.
+
+A ChangeFeed is a bounded in-memory log (CHANGE_FEED_CAPACITY, default 10000 events) of the PUTs and DELETEs
+a replica applies, whether from a client, replicated from another member of its shard, or replayed after
+catching up or joining a shard. Raw value writes appear as put-raw/delete-raw events without the bytes,
+which consumers read from /kvs/<key>/raw.
+
+GET /shard/changes streams the events as Server-Sent Events in the order they were applied, each with its
+causal metadata and an offset used as the event id. Consumers resume with ?offset=<n> or Last-Event-ID, and
+get a 410 once their offset has been evicted; ?format=json returns one batch instead of a stream.
+
+Offsets are assigned by each replica on its own and are not shared across the shard. Every event and
+response therefore names the replica it came from (the stream also sends X-Replica), and a consumer resuming
+with ?replica=<address> gets a 409 from any other replica, so it should stay pinned to one replica and start
+from the current offset after failing over. Consumers wait on a condition variable, so tailing the feed adds
+no work to the request path.
+"""
+
+import time
+import threading
+from collections import deque
+
+class ChangeFeed:
+    def __init__(self, capacity=10000, replica=None):
+        """
+        Initializes a bounded in-memory log of the writes applied by this replica.
+        Every event gets an offset one higher than the last; once more than <capacity> events have
+        been written, the oldest are evicted and can no longer be read.
+        Offsets are only meaningful on the replica that assigned them, so every event names <replica>.
+
+        :param capacity: The number of most recent events kept
+        :param replica: The address of the replica the feed belongs to
+        """
+        self.capacity = capacity
+        self.replica = replica
+        self.events = deque(maxlen=capacity)
+        self.next_offset = 0
+        self.changed = threading.Condition()
+
+    def append(self, op, key, value, causal_metadata, origin):
+        """
+        Records a write and wakes every consumer waiting for new events.
+
+        :param op: One of "put", "delete", "put-raw", or "delete-raw"
+        :param key: The key that was written
+        :param value: The new value, or None for a delete or a raw value
+        :param causal_metadata: The vector clock of this replica after the write
+        :param origin: The replica that received the write from the client
+        RETURN: The offset of the event
+        """
+        with self.changed:
+            offset = self.next_offset
+            self.events.append({"offset": offset, "op": op, "key": key, "value": value,
+                                "causal-metadata": dict(causal_metadata), "origin": origin, "replica": self.replica,
+                                "time": time.time()})
+            self.next_offset += 1
+            self.changed.notify_all()
+        return offset
+
+    def first_offset(self):
+        """
+        Returns the offset of the oldest event still kept.
+        """
+        with self.changed:
+            return self.next_offset - len(self.events)
+
+    def read(self, offset, limit=100, timeout=None):
+        """
+        Returns the events starting at <offset>, waiting up to <timeout> seconds for one to be written
+        if there are none yet.
+
+        :param offset: The offset of the first event to return
+        :param limit: The largest number of events returned
+        :param timeout: How long to wait for new events, or None to return immediately
+        RETURN: A list of events, or None if <offset> has already been evicted
+        """
+        with self.changed:
+            if timeout is not None:
+                self.changed.wait_for(lambda: self.next_offset > offset, timeout)
+            first = self.next_offset - len(self.events)
+            if offset < first:
+                return None
+            start = offset - first
+            return [self.events[i] for i in range(start, min(start + limit, len(self.events)))]
@@ -0,0 +1,190 @@
+import io
+import json
+import zlib
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESS_THRESHOLD = 1024                       # Bodies at least this large use the best codec
+DICTIONARY_THRESHOLD = 128                      # Smaller bodies than this are sent as is
+CODECS_HEADER = "X-Accept-Content-Encoding"     # Advertises the codecs a replica can decode
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024        # Largest body a compressed request may expand to
+
+# Shared by every replica so that small replication messages compress well on their own
+PRESET_DICTIONARY = (
+    b'{"causal-metadata": {"10.10.0.2:8090": 0, "10.10.0.3:8090": 0, "10.10.0.4:8090": 0}, '
+    b'"value": "", "vc": {}, "key": null, "shard": "s0", "from_shard": "s1", "new-store": {}, '
+    b'"result": "created", "replaced", "socket-address": "", "node_port": "", "shards": {"s0": []}, '
+    b'"store": {}, "mapping": {}, "ring": "{\\"py/object\\": \\"consistent_hash.ConsistentRing\\"'
+)
+
+def supported_codecs():
+    """
+    Returns the codecs this replica can decode, best first.
+    """
+    codecs = ["deflate", "x-deflate-dict"]
+    if zstandard is not None:
+        codecs.insert(0, "zstd")
+    return codecs
+
+def choose_codec(body_size, peer_codecs):
+    """
+    Picks the codec to send a body of <body_size> bytes with, based on what the peer can decode.
+
+    :param body_size: The size of the uncompressed body
+    :param peer_codecs: The codecs the peer advertised, or None if it has not advertised any yet
+    RETURN: The codec name, or None to send the body uncompressed
+    """
+    if not peer_codecs or body_size < DICTIONARY_THRESHOLD:
+        return None
+    if body_size < COMPRESS_THRESHOLD:
+        return "x-deflate-dict" if "x-deflate-dict" in peer_codecs else None
+    for codec in supported_codecs():
+        if codec != "x-deflate-dict" and codec in peer_codecs:
+            return codec
+    return None
+
+def compress(data, codec):
+    """
+    Compresses <data> with <codec>.
+    """
+    if codec == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    if codec == "x-deflate-dict":
+        compressor = zlib.compressobj(zdict=PRESET_DICTIONARY)
+        return compressor.compress(data) + compressor.flush()
+    if codec == "deflate":
+        return zlib.compress(data)
+    raise ValueError(f"Unsupported codec {codec}")
+
+def deflate_stream(chunks, stats=None):
+    """
+    Compresses a streamed body, given as byte <chunks>, into one deflate stream.
+    The first chunk is flushed on its own so the receiver can read it before the rest has been compressed.
+
+    :param stats: The CompressionStats the sizes of the whole body are recorded in once it has been sent
+    """
+    compressor = zlib.compressobj()
+    raw_bytes = wire_bytes = 0
+    for i, chunk in enumerate(chunks):
+        raw_bytes += len(chunk)
+        wire = compressor.compress(chunk)
+        if i == 0:
+            wire += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if wire:
+            wire_bytes += len(wire)
+            yield wire
+    wire = compressor.flush()
+    wire_bytes += len(wire)
+    yield wire
+    if stats is not None:
+        stats.record("response", "deflate", raw_bytes, wire_bytes)
+
+class BodyTooLarge(ValueError):
+    """
+    Raised when a compressed body expands to more than the allowed size.
+    """
+
+def decompress(data, codec, max_size=MAX_DECOMPRESSED_SIZE):
+    """
+    Decompresses <data> that was compressed with <codec>.
+
+    :param max_size: The largest size the body may expand to, so a small body cannot exhaust memory
+    RETURN: The decompressed bytes; raises BodyTooLarge past <max_size>, or the codec's error on a corrupt body
+    """
+    if codec == "zstd":
+        # The streaming reader never trusts the content size written in the frame
+        body = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read(max_size + 1)
+    elif codec in ("x-deflate-dict", "deflate"):
+        decompressor = zlib.decompressobj(zdict=PRESET_DICTIONARY) if codec == "x-deflate-dict" else zlib.decompressobj()
+        body = decompressor.decompress(data, max_size + 1)
+        if len(body) <= max_size:
+            body += decompressor.flush()
+            if not decompressor.eof:
+                raise zlib.error("Compressed body is truncated")
+    else:
+        raise ValueError(f"Unsupported codec {codec}")
+    if len(body) > max_size:
+        raise BodyTooLarge(f"Body expands to more than {max_size} bytes")
+    return body
+
+def decode_errors():
+    """
+    Returns the exceptions a corrupt body can raise while it is decompressed.
+    """
+    errors = (zlib.error, ValueError)
+    if zstandard is not None:
+        errors += (zstandard.ZstdError,)
+    return errors
+
+class CompressionStats:
+    def __init__(self):
+        """
+        Initializes counters of bytes before and after compression for each direction.
+        """
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def record(self, direction, codec, raw_bytes, wire_bytes):
+        """
+        Records one message.
+
+        :param direction: One of "sent", "received", or "response"
+        :param codec: The codec used, or None for uncompressed messages
+        :param raw_bytes: The size of the message before compression
+        :param wire_bytes: The size of the message as sent over the network
+        """
+        with self.lock:
+            counter = self.counters.setdefault(direction, {"messages": 0, "compressed": 0, "raw-bytes": 0, "wire-bytes": 0})
+            counter["messages"] += 1
+            counter["compressed"] += codec is not None
+            counter["raw-bytes"] += raw_bytes
+            counter["wire-bytes"] += wire_bytes
+
+    def snapshot(self):
+        """
+        Returns a copy of the counters.
+        """
+        with self.lock:
+            return {direction: dict(counter) for direction, counter in self.counters.items()}
+
+class DecompressingMiddleware:
+    def __init__(self, wsgi_app, stats, max_size=MAX_DECOMPRESSED_SIZE):
+        """
+        Wraps a WSGI app so that request bodies sent with a supported Content-Encoding are
+        decompressed before Flask reads them. Corrupt bodies are answered with a 400 and bodies
+        expanding past <max_size> bytes with a 413, without reaching the app.
+
+        :param wsgi_app: The WSGI app to wrap
+        :param stats: The CompressionStats that received messages are recorded in
+        :param max_size: The largest size a request body may expand to
+        """
+        self.wsgi_app = wsgi_app
+        self.stats = stats
+        self.max_size = max_size
+
+    def reject(self, start_response, status, message):
+        body = json.dumps({"error": message}).encode()
+        start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    def __call__(self, environ, start_response):
+        codec = environ.get("HTTP_CONTENT_ENCODING")
+        if codec in supported_codecs():
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+            wire = environ["wsgi.input"].read(length)
+            try:
+                body = decompress(wire, codec, self.max_size)
+            except BodyTooLarge:
+                return self.reject(start_response, "413 Request Entity Too Large", "Decompressed body is too large")
+            except decode_errors():
+                return self.reject(start_response, "400 Bad Request", f"Body is not valid {codec} data")
+            self.stats.record("received", codec, len(body), len(wire))
+
+            environ["wsgi.input"] = io.BytesIO(body)
+            environ["CONTENT_LENGTH"] = str(len(body))
+            del environ["HTTP_CONTENT_ENCODING"]
+        return self.wsgi_app(environ, start_response)
@@ -20,14 +20,20 @@ class ConsistentRing:
         self.shard_names = []                   # Store all shard names, including virtual shards 
         self.hash_limit = 2**16
         self.virtual_shards = virtual_shards
+        self.shard_weights = {}                 # Store the number of virtual shards each shard has
     
-    def add_new_shard(self, shard):
+    def add_new_shard(self, shard, weight=None):
         """
         Adds a real shard to the ring and creates virtual shards associated with it.
         This helps our key-value store have balanced loads.
 
         :param shard: The shard to add to the ring
+        :param weight: The number of virtual shards to create, defaults to virtual_shards
         """
+        if weight is None:
+            weight = self.virtual_shards
+        self.shard_weights[shard] = weight
+
         # Hash it and use bisect to get the correct location around the ring
         shard_value = sha256_hasher(shard, self.hash_limit)
         ring_location = bisect.bisect(self.shard_locations, shard_value)
@@ -35,12 +41,49 @@ class ConsistentRing:
         self.shard_names.insert(ring_location, shard)
 
         # Create virtual shards associated with the real shard
-        for i in range(self.virtual_shards):
-            virtual_shard = sha256_hasher(f"{shard}-{i}", self.hash_limit)
-            bisect.insort(self.shard_locations, virtual_shard)
-            insert_location = bisect.bisect_left(self.shard_locations, virtual_shard)
-            # Insert the virtual shard based on bisect insert location
-            self.shard_names.insert(insert_location, shard)
+        for i in range(weight):
+            self._add_virtual_shard(shard, i)
+
+    def _add_virtual_shard(self, shard, i):
+        """
+        Inserts the <i>th virtual shard of <shard> into the ring.
+        """
+        virtual_shard = sha256_hasher(f"{shard}-{i}", self.hash_limit)
+        bisect.insort(self.shard_locations, virtual_shard)
+        insert_location = bisect.bisect_left(self.shard_locations, virtual_shard)
+        # Insert the virtual shard based on bisect insert location
+        self.shard_names.insert(insert_location, shard)
+
+    def _remove_virtual_shard(self, shard, i):
+        """
+        Removes the <i>th virtual shard of <shard> from the ring.
+        """
+        virtual_shard = sha256_hasher(f"{shard}-{i}", self.hash_limit)
+        location = bisect.bisect_left(self.shard_locations, virtual_shard)
+        # Several virtual shards may hash to the same location, so find the one owned by <shard>
+        while location < len(self.shard_locations) and self.shard_locations[location] == virtual_shard:
+            if self.shard_names[location] == shard:
+                self.shard_locations.pop(location)
+                self.shard_names.pop(location)
+                return
+            location += 1
+
+    def set_shard_weight(self, shard, weight):
+        """
+        Changes the number of virtual shards of a shard already in the ring.
+        Only the virtual shards above the smaller of the old and new weight are added or removed,
+        so only the key ranges next to those virtual shards change owners.
+
+        :param shard: The shard to reweight
+        :param weight: The new number of virtual shards, at least 1
+        """
+        weight = max(1, int(weight))
+        current = self.shard_weights.get(shard, self.virtual_shards)
+        for i in range(current, weight):
+            self._add_virtual_shard(shard, i)
+        for i in reversed(range(weight, current)):
+            self._remove_virtual_shard(shard, i)
+        self.shard_weights[shard] = weight
     
     def remove_shard(self, shard):
         """
@@ -50,8 +93,8 @@ class ConsistentRing:
         """
         # Calculate and determine where the given shard is located on the ring
         shard_value = sha256_hasher(shard, self.hash_limit)
-        ring_location = bisect(self.shard_locations, shard_value)
-        if self.shard_locations[ring_location] != shard_value:
+        ring_location = bisect.bisect_left(self.shard_locations, shard_value)
+        if ring_location == len(self.shard_locations) or self.shard_locations[ring_location] != shard_value:
             raise Exception("Shard isn't in the ring...\n")
         
         # Enumerate and reverse the locations list so we avoid out of bounds accesses
@@ -61,6 +104,7 @@ class ConsistentRing:
             if self.shard_names[location] == shard:
                 self.shard_names.pop(location)
                 self.shard_locations.pop(location)
+        self.shard_weights.pop(shard, None)
     
     def reset_ring(self):
         """
@@ -69,7 +113,30 @@ class ConsistentRing:
         if self.shard_locations and self.shard_names:
             self.shard_locations.clear()
             self.shard_names.clear()
+        self.shard_weights.clear()
     
+    def to_dict(self):
+        """
+        Returns a JSON serializable form of the ring.
+        """
+        return {"shard_locations": list(self.shard_locations), "shard_names": list(self.shard_names),
+                "shard_weights": dict(self.shard_weights), "hash_limit": self.hash_limit,
+                "virtual_shards": self.virtual_shards}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuilds a ring from the output of to_dict.
+        """
+        ring = cls(int(data.get("virtual_shards", 1000)))
+        ring.hash_limit = int(data.get("hash_limit", ring.hash_limit))
+        ring.shard_locations = [int(location) for location in data["shard_locations"]]
+        ring.shard_names = [str(name) for name in data["shard_names"]]
+        ring.shard_weights = {str(shard): int(weight) for shard, weight in data.get("shard_weights", {}).items()}
+        if len(ring.shard_locations) != len(ring.shard_names):
+            raise ValueError("Ring locations and names do not match")
+        return ring
+
     # Description: Performs the "walk" in a consistent hashing assignment
     # USAGE: This method is used to figure out the hash value of a key and assign it to a shard
     # RETURN: Returns the shard name the key gets assigned to along with the hash value
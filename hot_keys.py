@@ -0,0 +1,95 @@
+import time
+import threading
+from collections import OrderedDict
+
+class SpaceSavingCounter:
+    def __init__(self, capacity, decay_every=10000):
+        """
+        Initializes a space-saving top-K counter that approximates the most frequently seen keys.
+        Only <capacity> counters are ever kept, so memory does not grow with the number of keys.
+
+        :param capacity: The number of keys that are tracked at once
+        :param decay_every: Number of observations after which all counts are halved so that
+                            the counter follows recent traffic rather than all-time traffic
+        """
+        self.capacity = capacity
+        self.decay_every = decay_every
+        self.counts = {}
+        self.observations = 0
+        self.lock = threading.Lock()
+
+    def observe(self, key):
+        """
+        Records one access of <key>.
+
+        :param key: The key that was accessed
+        RETURN: The estimated access count of the key
+        """
+        with self.lock:
+            self.observations += 1
+            if self.observations % self.decay_every == 0:
+                self.counts = {k: c // 2 for k, c in self.counts.items() if c // 2 > 0}
+
+            if key in self.counts:
+                self.counts[key] += 1
+            elif len(self.counts) < self.capacity:
+                self.counts[key] = 1
+            else:
+                # Replace the least counted key, inheriting its count as the error bound
+                min_key = min(self.counts, key=self.counts.get)
+                min_count = self.counts.pop(min_key)
+                self.counts[key] = min_count + 1
+            return self.counts[key]
+
+    def top(self, n):
+        """
+        Returns the <n> keys with the highest estimated counts as (key, count) pairs.
+        """
+        with self.lock:
+            return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+class HotKeyCache:
+    def __init__(self, max_entries, lease):
+        """
+        Initializes a small read-through cache for hot keys owned by other shards.
+        Entries expire after a short lease and are also dropped when an invalidation arrives.
+
+        :param max_entries: The maximum number of cached keys, evicted least recently used first
+        :param lease: The number of seconds a cached value may be served for
+        """
+        self.max_entries = max_entries
+        self.lease = lease
+        self.entries = OrderedDict()            # key -> (value, causal metadata, expiry time)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached (value, causal metadata) of <key>, or None if missing or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, vc, expires = entry
+            if time.monotonic() > expires:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value, vc
+
+    def put(self, key, value, vc):
+        """
+        Caches <value> for <key> along with the causal metadata it was read at.
+        """
+        with self.lock:
+            self.entries[key] = (value, vc, time.monotonic() + self.lease)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Drops <key> from the cache if it is present.
+        """
+        with self.lock:
+            self.entries.pop(key, None)
@@ -0,0 +1,65 @@
+import bisect
+import threading
+
+class KeyIndex:
+    def __init__(self, keys=()):
+        """
+        Initializes a sorted index of the keys in a replica's store, used to list keys in order
+        without sorting the whole store on every request.
+
+        :param keys: The keys to index initially
+        """
+        self.lock = threading.Lock()
+        self.keys = sorted(keys)
+
+    def add(self, key):
+        """
+        Adds <key> to the index if it is not already there.
+        """
+        with self.lock:
+            pos = bisect.bisect_left(self.keys, key)
+            if pos == len(self.keys) or self.keys[pos] != key:
+                self.keys.insert(pos, key)
+
+    def discard(self, key):
+        """
+        Removes <key> from the index if it is there.
+        """
+        with self.lock:
+            pos = bisect.bisect_left(self.keys, key)
+            if pos < len(self.keys) and self.keys[pos] == key:
+                del self.keys[pos]
+
+    def rebuild(self, keys):
+        """
+        Replaces the index with <keys>, used after the store is replaced or changed in bulk.
+        """
+        keys = sorted(keys)
+        with self.lock:
+            self.keys = keys
+
+    def page(self, prefix="", after=None, limit=100):
+        """
+        Returns keys in sorted order.
+
+        :param prefix: Only keys starting with this are returned
+        :param after: Only keys sorting after this are returned, used as the cursor of the previous page
+        :param limit: The largest number of keys returned
+        RETURN: The list of keys, and whether more keys matched after the last one returned
+        """
+        with self.lock:
+            if after is not None and after >= prefix:
+                pos = bisect.bisect_right(self.keys, after)
+            else:
+                pos = bisect.bisect_left(self.keys, prefix)
+            page = []
+            while pos < len(self.keys) and len(page) <= limit:
+                key = self.keys[pos]
+                if not key.startswith(prefix):
+                    break
+                page.append(key)
+                pos += 1
+        return page[:limit], len(page) > limit
+
+    def __len__(self):
+        return len(self.keys)
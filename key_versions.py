@@ -0,0 +1,72 @@
+"""
+Per-key versions, used when a replica runs with CAUSAL_MODE=per-key.
+
+Every write of a key gets a version [counter, replica], compared by counter and then by replica, and the
+causal metadata a client carries is a dict of the versions of the keys it has read or written. A read is only
+answered with a 503 if the replica has not yet applied the client's version of that key, writes never wait
+for other keys, and no vector clock is broadcast to the whole View.
+
+Versions travel with replicated writes, resharding, rebalancing, startup catch-up, and shard join snapshots.
+Deleted keys keep their version so reads after a delete stay consistent. When keys move to another shard,
+their versions are grouped by new owner in a single pass, sent along, and dropped from the old shard.
+
+Without the vector clock broadcast there is no hot-key invalidation either: copies of a key cached by other
+shards are only dropped when their lease runs out, and a cached copy is never served to a client whose
+metadata requires a newer version of the key. Since only the keys a request touches are checked, guarantees
+hold per key (read-your-writes, monotonic reads and writes) rather than across keys.
+"""
+
+def valid(version):
+    """
+    Returns True if <version> is a version, i.e. a [counter, replica] pair.
+    """
+    return isinstance(version, (list, tuple)) and len(version) == 2
+
+def newer(version, other):
+    """
+    Returns True if <version> is newer than <other>.
+    Versions are compared by counter first and by the replica that made the write second,
+    so concurrent writes of a key are ordered the same way on every replica.
+    """
+    if not valid(version):
+        return False
+    return not valid(other) or tuple(version) > tuple(other)
+
+def covers(version, required):
+    """
+    Returns True if a replica whose latest write of a key has <version> has seen the write <required>.
+    """
+    if not valid(required):
+        return True
+    return valid(version) and tuple(version) >= tuple(required)
+
+def next_version(replica, *seen):
+    """
+    Returns the version of a new write made at <replica> after every version in <seen>.
+    """
+    counter = max([version[0] for version in seen if valid(version)], default=0)
+    return [counter + 1, replica]
+
+def dependency(metadata, key):
+    """
+    Returns the version of <key> that the client's causal metadata depends on, or None if it has none.
+    """
+    if not isinstance(metadata, dict):
+        return None
+    version = metadata.get(key)
+    return version if valid(version) else None
+
+def merge(metadata, versions):
+    """
+    Returns the client's causal metadata with <versions> merged in, keeping the newer version of each key.
+    Entries that are not versions, such as a vector clock sent by an older client, are dropped.
+
+    :param metadata: The causal metadata sent by the client
+    :param versions: A dict of key -> version
+    """
+    merged = {key: version for key, version in (metadata or {}).items() if valid(version)} \
+        if isinstance(metadata, dict) else {}
+    for key, version in versions.items():
+        if newer(version, merged.get(key)):
+            merged[key] = list(version)
+    return merged
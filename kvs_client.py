@@ -0,0 +1,154 @@
+import time
+import random
+import requests
+from requests.adapters import HTTPAdapter
+from consistent_hash import ConsistentRing
+import key_versions
+
+class KVSClient:
+    def __init__(self, bootstrap_nodes, refresh_interval=5.0, timeout=2, pool_size=10):
+        """
+        Initializes a client that caches the shard layout and hash ring of the key-value store.
+        Requests are sent directly to a member of the shard that owns the key instead of
+        being proxied by whichever replica happens to receive them.
+
+        :param bootstrap_nodes: A list of replica socket addresses used to learn the topology
+        :param refresh_interval: Seconds before the cached topology is considered stale
+        :param timeout: Timeout in seconds for each request made to a replica
+        :param pool_size: Number of pooled connections kept per replica
+        """
+        self.bootstrap_nodes = list(bootstrap_nodes)
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.causal_metadata = None             # Causal metadata carried between calls
+        self.shards = {}                        # Shard id -> list of member addresses
+        self.ring = None                        # Local copy of the ConsistentRing
+        self.last_refresh = 0
+
+        # Reuse TCP connections to the replicas across calls
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+
+    def refresh_topology(self):
+        """
+        Fetches the members of every shard and the hash ring from any reachable replica.
+        The ring is sent as plain JSON and rebuilt here, so no objects are decoded from the network.
+        RETURN: True if the topology was refreshed, False if no replica answered
+        """
+        nodes = self.bootstrap_nodes + [rep for members in self.shards.values() for rep in members]
+        for node in dict.fromkeys(nodes):
+            try:
+                data = self.session.get(f"http://{node}/shard/ring", timeout=self.timeout).json()
+                shards = {str(shard_id): list(members) for shard_id, members in data["shards"].items()}
+                ring = ConsistentRing.from_dict(data["ring"])
+            except (requests.exceptions.RequestException, ValueError, KeyError, TypeError, AttributeError):
+                continue
+
+            self.shards = shards
+            self.ring = ring
+            self.last_refresh = time.monotonic()
+            return True
+        return False
+
+    def owner_of(self, key):
+        """
+        Determines the shard that owns <key> using the cached ring, refreshing the ring if it is stale.
+
+        :param key: The key to locate
+        RETURN: The shard id that owns the key, or None if the topology is unknown
+        """
+        if self.ring is None or time.monotonic() - self.last_refresh > self.refresh_interval:
+            self.refresh_topology()
+        if self.ring is None or not self.ring.shard_locations:
+            return None
+        shard, hash_value = self.ring.key_to_shard(key)
+        return shard
+
+    def _merge_metadata(self, new_vc):
+        """
+        Merges the causal metadata returned by a replica into the metadata tracked by this client.
+        The metadata is either a vector clock of replica -> counter, or in per-key mode a dict of
+        key -> version, whose entries are merged by keeping the newer version.
+        """
+        if not new_vc:
+            return
+        if self.causal_metadata is None:
+            self.causal_metadata = dict(new_vc)
+            return
+        if any(key_versions.valid(value) for value in new_vc.values()):
+            self.causal_metadata = key_versions.merge(self.causal_metadata, new_vc)
+            return
+        for rep, value in new_vc.items():
+            self.causal_metadata[rep] = max(self.causal_metadata.get(rep, 0), value)
+
+    def _send(self, method, key, data):
+        """
+        Sends a request for <key> to a member of the owning shard, falling back to any replica.
+
+        :param method: The HTTP method to use
+        :param key: The key the request is for
+        :param data: The JSON body of the request
+        RETURN: The response received from a replica
+        """
+        for attempt in range(2):
+            shard = self.owner_of(key)
+            members = list(self.shards.get(shard, [])) if shard is not None else []
+            random.shuffle(members)
+            # Fall back to proxied requests through any replica if the owning shard is unreachable
+            candidates = members + [node for node in self.bootstrap_nodes if node not in members]
+            for rep in candidates:
+                try:
+                    res = self.session.request(method, f"http://{rep}/kvs/{key}", json=data, timeout=self.timeout)
+                except requests.exceptions.RequestException:
+                    continue
+                # A created key reports the shard it landed in; a mismatch means the cluster resharded
+                body = self._body(res)
+                if body.get("shard-id") not in (None, shard) or rep not in members:
+                    self.last_refresh = 0
+                return res
+            # Nothing answered, so the cached topology is likely out of date
+            self.refresh_topology()
+        raise requests.exceptions.ConnectionError(f"No replica could serve the request for {key}")
+
+    def _body(self, res):
+        """
+        Returns the JSON body of a response, or an error body if the replica did not answer with JSON.
+        """
+        try:
+            return res.json()
+        except ValueError:
+            return {"error": res.text}
+
+    def get(self, key):
+        """
+        Returns the status code and body of a GET for <key>.
+        """
+        res = self._send("GET", key, {"causal-metadata": self.causal_metadata})
+        body = self._body(res)
+        self._merge_metadata(body.get("causal-metadata"))
+        return res.status_code, body
+
+    def put(self, key, value):
+        """
+        Returns the status code and body of a PUT that sets <key> to <value>.
+        """
+        res = self._send("PUT", key, {"value": value, "causal-metadata": self.causal_metadata})
+        body = self._body(res)
+        self._merge_metadata(body.get("causal-metadata"))
+        return res.status_code, body
+
+    def delete(self, key):
+        """
+        Returns the status code and body of a DELETE for <key>.
+        """
+        res = self._send("DELETE", key, {"causal-metadata": self.causal_metadata})
+        body = self._body(res)
+        self._merge_metadata(body.get("causal-metadata"))
+        return res.status_code, body
+
+    def close(self):
+        """
+        Closes all pooled connections.
+        """
+        self.session.close()
@@ -0,0 +1,55 @@
+LOAD_METRICS = ("key-count", "bytes", "request-rate")
+
+def shard_loads(stats):
+    """
+    Combines the per-shard statistics into a single relative load for each shard.
+    Each metric is converted into the shard's share of the cluster total, scaled so that a
+    perfectly balanced shard has a load of 1, and the shares are averaged across metrics.
+
+    :param stats: A dict of shard -> {"key-count", "bytes", "request-rate"}
+    RETURN: A dict of shard -> relative load, or an empty dict if there is no load yet
+    """
+    loads = {shard: 0.0 for shard in stats}
+    used_metrics = 0
+    for metric in LOAD_METRICS:
+        total = sum(shard_stats.get(metric, 0) for shard_stats in stats.values())
+        if total <= 0:
+            continue
+        used_metrics += 1
+        for shard, shard_stats in stats.items():
+            loads[shard] += shard_stats.get(metric, 0) / total * len(stats)
+
+    if used_metrics == 0:
+        return {}
+    return {shard: load / used_metrics for shard, load in loads.items()}
+
+def load_ratio(loads):
+    """
+    Returns the max/mean ratio of the given relative loads, which is 1 for a perfectly balanced cluster.
+    """
+    if not loads:
+        return 1.0
+    mean = sum(loads.values()) / len(loads)
+    return max(loads.values()) / mean if mean > 0 else 1.0
+
+def plan_rebalance(stats, weights, tolerance=0.05, max_step=0.25):
+    """
+    Determines new virtual shard weights that move load from overloaded shards to underloaded ones.
+    Weights change by at most <max_step> per round so that only a small part of the ring moves at once.
+
+    :param stats: A dict of shard -> {"key-count", "bytes", "request-rate"}
+    :param weights: A dict of shard -> current number of virtual shards
+    :param tolerance: How far a shard's load may be from the mean before it is reweighted
+    :param max_step: The largest fractional change of a shard's weight in a single round
+    RETURN: A dict of shard -> new number of virtual shards
+    """
+    loads = shard_loads(stats)
+    new_weights = dict(weights)
+    for shard, load in loads.items():
+        if shard not in weights or abs(load - 1) <= tolerance:
+            continue
+        # A shard with twice the average load should get roughly half the ring space
+        factor = 1 / load if load > 0 else 1 + max_step
+        factor = min(max(factor, 1 - max_step), 1 + max_step)
+        new_weights[shard] = max(1, round(weights[shard] * factor))
+    return new_weights
@@ -0,0 +1,363 @@
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+import contextvars
+import importlib.util
+from urllib.parse import urlparse, urlencode, parse_qsl
+import requests
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+CLIENT = "client"
+
+# Virtual time of the operation running in the current thread, copied into parallel broadcasts
+virtual_now = contextvars.ContextVar("virtual_now", default=0.0)
+
+class SimResponse:
+    def __init__(self, response, url):
+        """
+        Wraps a Flask test response so replicas can use it like a requests.Response.
+        """
+        self.url = url
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.get_data()
+        self.wire_size = len(self.content)
+        if self.headers.get("Content-Encoding") == "deflate":
+            self.content = zlib.decompress(self.content)
+
+    @property
+    def text(self):
+        return self.content.decode(errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        for pos in range(0, len(self.content), chunk_size):
+            yield self.content[pos:pos + chunk_size]
+
+    def iter_lines(self):
+        for line in self.content.splitlines():
+            if line:
+                yield line
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class SimTime:
+    """
+    Stands in for the time module inside a simulated replica so that sleeps advance virtual time.
+    """
+
+    def sleep(self, seconds):
+        virtual_now.set(virtual_now.get() + seconds)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+class SimNetwork:
+    def __init__(self, latency=0.001, jitter=0.0005, loss=0.0, seed=0, verbose=False):
+        """
+        Initializes a simulated network between in-process replicas.
+
+        :param latency: The mean one way delay of a message in seconds
+        :param jitter: The maximum random deviation from the mean delay
+        :param loss: The probability that a request is dropped
+        :param seed: The seed of the network's random number generator
+        :param verbose: Whether the replicas' own log output is printed
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.verbose = verbose
+        self.nodes = {}                         # address -> simulated replica module
+        self.partitions = []                    # Groups of addresses that can only reach each other
+        self.lock = threading.Lock()
+        self.reset_counters()
+
+    def reset_counters(self):
+        """
+        Clears the message and byte counters.
+        """
+        with self.lock:
+            self.messages = 0
+            self.bytes = 0
+            self.dropped = 0
+            self.horizon = 0.0                  # Latest virtual time any branch of the operation reached
+
+    def counters(self):
+        """
+        Returns the messages, bytes, and dropped messages counted so far.
+        """
+        with self.lock:
+            return {"messages": self.messages, "bytes": self.bytes, "dropped": self.dropped}
+
+    def partition(self, *groups):
+        """
+        Splits the network so that replicas can only reach replicas in their own group.
+        The client can reach every replica.
+        """
+        self.partitions = [set(group) for group in groups]
+
+    def heal(self):
+        """
+        Removes all partitions.
+        """
+        self.partitions = []
+
+    def reachable(self, src, dst):
+        if src == CLIENT or not self.partitions:
+            return True
+        return any(src in group and dst in group for group in self.partitions)
+
+    def delay(self):
+        with self.lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def send(self, src, method, url, json_body=None, data=None, headers=None, params=None, timeout=None):
+        """
+        Delivers one HTTP request to the simulated replica named in <url> and returns its response.
+        Raises the same requests exceptions a real network would for lost or unreachable messages.
+        """
+        parts = urlparse(url)
+        dst, path = parts.netloc, parts.path
+        # Like requests, <params> are appended to the query the URL already has, and None values are left out
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        if params:
+            query += [(name, value) for name, value in (params.items() if isinstance(params, dict) else params)
+                      if value is not None]
+        if query:
+            path = f"{path}?{urlencode(query, doseq=True)}"
+        headers = dict(headers or {})
+        headers.setdefault("Accept-Encoding", "deflate")
+
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers["Content-Type"] = "application/json"
+        elif data is None or isinstance(data, (bytes, bytearray)):
+            body = bytes(data or b"")
+        else:
+            # Generators of chunks, as used for streamed values
+            body = b"".join(bytes(chunk) for chunk in data)
+
+        with self.lock:
+            self.messages += 1
+            self.bytes += len(body) + sum(len(k) + len(str(v)) for k, v in headers.items())
+            lost = self.random.random() < self.loss
+
+        if dst not in self.nodes or not self.reachable(src, dst):
+            raise requests.exceptions.ConnectionError(f"{dst} is unreachable from {src}")
+        if lost:
+            with self.lock:
+                self.dropped += 1
+            virtual_now.set(virtual_now.get() + (timeout or 1))
+            raise requests.exceptions.Timeout(f"Request to {dst} was lost")
+
+        virtual_now.set(virtual_now.get() + self.delay())
+        client = self.nodes[dst].app.test_client()
+        response = SimResponse(client.open(path, method=method.upper(), data=body, headers=headers), url)
+        virtual_now.set(virtual_now.get() + self.delay())
+
+        with self.lock:
+            self.bytes += response.wire_size
+            self.horizon = max(self.horizon, virtual_now.get())
+        return response
+
+class SimSession:
+    def __init__(self, network, address):
+        """
+        Stands in for the pooled requests session of the replica at <address>.
+        """
+        self.network = network
+        self.address = address
+        self.hooks = {"response": []}
+
+    def request(self, method, url, json=None, data=None, headers=None, params=None, timeout=None, stream=False):
+        res = self.network.send(self.address, method, url, json, data, headers, params, timeout)
+        for hook in self.hooks["response"]:
+            hook(res)
+        return res
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+def load_node(network, address, view, shard_count, causal_mode="vector"):
+    """
+    Imports a fresh copy of app.py as the replica at <address> and connects it to <network>.
+    """
+    env = {"SOCKET_ADDRESS": address, "VIEW": ",".join(view), "KVS_SIMULATION": "1", "CAUSAL_MODE": causal_mode}
+    if shard_count is not None:
+        env["SHARD_COUNT"] = str(shard_count)
+    saved = {name: os.environ.get(name) for name in set(env) | {"SHARD_COUNT"}}
+    os.environ.update(env)
+    if shard_count is None:
+        os.environ.pop("SHARD_COUNT", None)
+    try:
+        spec = importlib.util.spec_from_file_location(f"kvs_node_{address.replace('.', '_').replace(':', '_')}", APP_PATH)
+        node = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(node)
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    # Keeps the response hooks the replica installed, such as recording the load of its peers
+    hooks = node.peer_session.hooks["response"]
+    node.peer_session = SimSession(network, address)
+    node.peer_session.hooks["response"] = list(hooks)
+    node.time = SimTime()
+    if not network.verbose:
+        node.print = lambda *args, **kwargs: None
+    network.nodes[address] = node
+    return node
+
+def build_cluster(network, node_count, shard_count, causal_mode="vector"):
+    """
+    Starts <node_count> simulated replicas split into <shard_count> shards and runs their startup.
+    RETURN: The list of replica addresses
+    """
+    view = [f"10.0.{i // 250}.{i % 250 + 2}:8090" for i in range(node_count)]
+    for address in view:
+        load_node(network, address, view, shard_count, causal_mode)
+    for address in view:
+        bootstrap_node(network.nodes[address])
+    return view
+
+def bootstrap_node(node):
+    """
+    Runs the startup of a simulated replica in the calling thread.
+    """
+    node.blast_add(node.MY_ADDRESS)
+    node.startup["ready"] = node.get_info()
+
+def measure(network, action):
+    """
+    Runs <action> and returns the messages, bytes, and virtual seconds it cost.
+    Parallel broadcasts start at the virtual time of their caller, so the virtual seconds are
+    the latest time reached by any branch of the operation.
+    """
+    network.reset_counters()
+    token = virtual_now.set(0.0)
+    try:
+        result = action()
+        elapsed = max(virtual_now.get(), network.horizon)
+    finally:
+        virtual_now.reset(token)
+    cost = network.counters()
+    cost["virtual-seconds"] = elapsed
+    cost["result"] = result
+    return cost
+
+def client_call(network, method, address, path, body):
+    """
+    Sends a client request to the replica at <address>.
+    RETURN: The status code
+    """
+    try:
+        return network.send(CLIENT, method, f"http://{address}{path}", json_body=body).status_code
+    except requests.exceptions.RequestException as e:
+        return type(e).__name__
+
+def run_scenario(node_count, shard_count, operations, latency, loss, seed, verbose=False, causal_mode="vector"):
+    """
+    Builds a cluster and measures the average cost of client operations, a reshard, and adding a member.
+    RETURN: A dict of measurement name -> averaged cost
+    """
+    random.seed(seed)
+    network = SimNetwork(latency=latency, loss=loss, seed=seed, verbose=verbose)
+    report = {}
+
+    start = measure(network, lambda: build_cluster(network, node_count, shard_count, causal_mode))
+    view = start["result"]
+    report["startup (whole cluster)"] = start
+
+    for name, method, body in (("put", "PUT", lambda i: {"value": f"value-{i}", "causal-metadata": None}),
+                               ("get", "GET", lambda i: {"causal-metadata": None}),
+                               ("delete", "DELETE", lambda i: {"causal-metadata": None})):
+        costs = [measure(network, lambda i=i: client_call(network, method, random.choice(view), f"/kvs/key-{i}", body(i)))
+                 for i in range(operations)]
+        report[name] = average(costs)
+        # Deleted keys are written back so later measurements see a populated store
+        if name == "delete":
+            for i in range(operations):
+                client_call(network, "PUT", random.choice(view), f"/kvs/key-{i}", {"value": i, "causal-metadata": None})
+
+    refresh = measure(network, lambda: [network.nodes[address].refresh_summaries() for address in view])
+    report["summary refresh (whole cluster)"] = refresh
+
+    new_shard_count = min(shard_count + 1, node_count // 2)
+    report["reshard"] = measure(network, lambda: client_call(network, "PUT", view[0], "/shard/reshard",
+                                                             {"shard-count": new_shard_count}))
+
+    # A new replica joins the View and is then added to the first shard
+    address = f"10.1.0.{node_count % 250 + 2}:8090"
+    def join():
+        node = load_node(network, address, view + [address], None, causal_mode)
+        bootstrap_node(node)
+        return client_call(network, "PUT", view[0], "/shard/add-member/s0", {"socket-address": address})
+    report["add member"] = measure(network, join)
+    return report
+
+def average(costs):
+    """
+    Averages the counters of several measurements.
+    """
+    total = {"messages": 0, "bytes": 0, "dropped": 0, "virtual-seconds": 0.0}
+    for cost in costs:
+        for name in total:
+            total[name] += cost[name]
+    statuses = sorted({str(cost["result"]) for cost in costs})
+    return dict({name: value / max(1, len(costs)) for name, value in total.items()}, result=",".join(statuses))
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the key-value store protocol on simulated replicas in one process "
+                                                 "and reports the messages and bytes each operation costs.")
+    parser.add_argument("--nodes", default="6,12,25,50,100,200", help="Comma separated cluster sizes")
+    parser.add_argument("--shards", type=int, default=2, help="Number of shards")
+    parser.add_argument("--ops", type=int, default=20, help="Client operations measured per type")
+    parser.add_argument("--latency", type=float, default=0.001, help="Mean one way message delay in seconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="Probability a message is dropped")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--causal-mode", choices=("vector", "per-key"), default="vector",
+                        help="How the replicas track causal dependencies")
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Print the log output of the replicas")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'nodes':>6} {'operation':<32} {'messages':>10} {'bytes':>12} {'virtual s':>10}  status")
+    for node_count in (int(n) for n in args.nodes.split(",")):
+        report = run_scenario(node_count, args.shards, args.ops, args.latency, args.loss, args.seed, args.verbose,
+                              args.causal_mode)
+        results[node_count] = report
+        for name, cost in report.items():
+            status = cost["result"] if not isinstance(cost["result"], list) else "ok"
+            print(f"{node_count:>6} {name:<32} {cost['messages']:>10.1f} {cost['bytes']:>12.0f} "
+                  f"{cost['virtual-seconds']:>10.3f}  {status}")
+        sys.stdout.flush()
+
+    if args.json:
+        print(json.dumps(results, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
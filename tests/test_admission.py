@@ -0,0 +1,93 @@
+import time
+import threading
+
+import requests
+
+import simulator as S
+from admission import Budget
+
+def test_budget_sheds_once_its_queue_is_full():
+    budget = Budget("test", 1, queue_limit=1, max_wait=None)
+    assert budget.acquire()
+    waiter = threading.Thread(target=budget.acquire)
+    waiter.start()
+    while budget.snapshot()["waiting"] == 0:
+        time.sleep(0.001)
+
+    assert not budget.acquire()
+    budget.release()
+    waiter.join()
+    assert budget.snapshot() == {"limit": 1, "queue-limit": 1, "active": 1, "waiting": 0, "admitted": 2, "shed": 1}
+
+def test_budget_sheds_after_the_longest_wait():
+    budget = Budget("test", 1, queue_limit=4, max_wait=0.01)
+
+    assert budget.acquire()
+    assert not budget.acquire()
+    assert budget.load() == 1.0
+
+def test_budget_without_limits_waits_for_a_slot():
+    budget = Budget("test", 1, queue_limit=None, max_wait=None)
+    assert budget.acquire()
+    timer = threading.Timer(0.05, budget.release)
+    timer.start()
+
+    assert budget.acquire()
+    timer.join()
+    assert budget.snapshot()["shed"] == 0
+
+class Reply:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+def sender(*outcomes):
+    """
+    Returns a send function for replicate_write that plays <outcomes> in turn, and the timeouts it was given.
+    """
+    outcomes, timeouts = list(outcomes), []
+    def send(timeout):
+        timeouts.append(timeout)
+        outcome = outcomes.pop(0) if len(outcomes) > 1 else outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return send, timeouts
+
+def replica():
+    net = S.SimNetwork()
+    view = S.build_cluster(net, 2, 1)
+    return net.nodes[view[0]], view[1]
+
+def test_replicate_write_retries_a_busy_replica():
+    node, rep = replica()
+    send, timeouts = sender(Reply(503, {"Retry-After": "1"}), requests.exceptions.Timeout(),
+                            requests.exceptions.Timeout(), Reply(201))
+
+    assert node.replicate_write(rep, send, set()).status_code == 201
+    assert timeouts == [1.0, 1.0, 2.0, 4.0]
+
+def test_replicate_write_declares_a_refusing_replica_down():
+    node, rep = replica()
+    send, timeouts = sender(requests.exceptions.ConnectionError())
+    to_remove = set()
+
+    assert node.replicate_write(rep, send, to_remove) is None
+    assert to_remove == {rep}
+    assert len(timeouts) == 2
+
+def test_replicate_write_gives_up_after_the_deadline():
+    node, rep = replica()
+    send, timeouts = sender(Reply(503, {"Retry-After": "1"}))
+    to_remove = set()
+
+    assert node.replicate_write(rep, send, to_remove) is None
+    assert len(timeouts) == node.REPLICATION_DEADLINE
+    assert not to_remove
+
+def test_replicate_write_does_not_retry_a_rejected_write():
+    node, rep = replica()
+    send, timeouts = sender(Reply(400))
+
+    assert node.replicate_write(rep, send, set()) is None
+    assert len(timeouts) == 1
@@ -0,0 +1,21 @@
+import time
+
+import simulator as S
+
+def test_catch_up_outlasts_the_deadline_once_a_header_arrived():
+    net = S.SimNetwork()
+    view = S.build_cluster(net, 2, 1)
+    for i in range(10):
+        net.send(S.CLIENT, "PUT", f"http://{view[0]}/kvs/key-{i}", json_body={"value": i, "causal-metadata": None})
+    node = net.nodes[view[1]]
+    node.Store = {}
+
+    # Reading the snapshot takes longer than the deadline, its header does not
+    read_snapshot_body = node.read_snapshot_body
+    def slow(lines, header):
+        time.sleep(0.5)
+        return read_snapshot_body(lines, header)
+    node.read_snapshot_body = slow
+
+    assert node.get_info(deadline=0.2)
+    assert node.Store == net.nodes[view[0]].Store
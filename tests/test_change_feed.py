@@ -0,0 +1,32 @@
+import threading
+
+from change_feed import ChangeFeed
+
+def test_read_returns_events_from_an_offset():
+    feed = ChangeFeed(capacity=10, replica="r1")
+    for i in range(5):
+        feed.append("put", f"k{i}", i, {}, "r2")
+
+    events = feed.read(2, limit=2)
+    assert [event["offset"] for event in events] == [2, 3]
+    assert events[0]["key"] == "k2" and events[0]["replica"] == "r1" and events[0]["origin"] == "r2"
+    assert feed.read(5) == []
+
+def test_read_of_an_evicted_offset_returns_none():
+    feed = ChangeFeed(capacity=3, replica="r1")
+    for i in range(5):
+        feed.append("delete", f"k{i}", None, {}, "r1")
+
+    assert feed.first_offset() == 2
+    assert feed.read(1) is None
+    assert [event["offset"] for event in feed.read(2)] == [2, 3, 4]
+
+def test_read_waits_for_a_new_event():
+    feed = ChangeFeed(capacity=10, replica="r1")
+    timer = threading.Timer(0.05, feed.append, ("put", "k", 1, {}, "r1"))
+    timer.start()
+
+    events = feed.read(0, timeout=5)
+    timer.join()
+    assert [event["key"] for event in events] == ["k"]
+    assert feed.read(1, timeout=0.01) == []
@@ -0,0 +1,26 @@
+from key_index import KeyIndex
+
+def test_page_lists_keys_in_order_with_a_cursor():
+    index = KeyIndex(["b", "a", "c", "d"])
+
+    assert index.page(limit=2) == (["a", "b"], True)
+    assert index.page(after="b", limit=2) == (["c", "d"], False)
+    assert index.page(after="d") == ([], False)
+
+def test_page_stops_at_the_end_of_the_prefix():
+    index = KeyIndex(["user:1", "user:2", "user:3", "video:1", "a"])
+
+    assert index.page(prefix="user:", limit=2) == (["user:1", "user:2"], True)
+    assert index.page(prefix="user:", after="user:2") == (["user:3"], False)
+    # A cursor from before the prefix starts at the prefix
+    assert index.page(prefix="user:", after="a", limit=1) == (["user:1"], True)
+
+def test_add_and_discard_keep_the_index_sorted_and_unique():
+    index = KeyIndex()
+    for key in ["c", "a", "b", "a"]:
+        index.add(key)
+    index.discard("b")
+    index.discard("missing")
+
+    assert index.page() == (["a", "c"], False)
+    assert len(index) == 2
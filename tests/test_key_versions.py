@@ -0,0 +1,30 @@
+import key_versions
+
+def test_versions_are_ordered_by_counter_then_replica():
+    assert key_versions.newer([2, "a"], [1, "b"])
+    assert key_versions.newer([1, "b"], [1, "a"])
+    assert not key_versions.newer([1, "a"], [1, "a"])
+    assert key_versions.newer([1, "a"], None)
+    assert not key_versions.newer(None, [1, "a"])
+
+def test_covers():
+    assert key_versions.covers([2, "a"], [1, "b"])
+    assert key_versions.covers([1, "a"], [1, "a"])
+    assert not key_versions.covers([1, "a"], [1, "b"])
+    assert not key_versions.covers(None, [1, "a"])
+    assert key_versions.covers(None, None)
+
+def test_next_version_follows_every_seen_version():
+    assert key_versions.next_version("a") == [1, "a"]
+    assert key_versions.next_version("a", [3, "b"], None, [1, "c"]) == [4, "a"]
+
+def test_dependency_ignores_anything_but_versions():
+    assert key_versions.dependency({"k": [1, "a"]}, "k") == [1, "a"]
+    assert key_versions.dependency({"k": 3}, "k") is None
+    assert key_versions.dependency(None, "k") is None
+
+def test_merge_keeps_the_newer_version_and_drops_vector_clocks():
+    metadata = {"k": [2, "a"], "j": [1, "a"], "10.0.0.2:8090": 4}
+    merged = key_versions.merge(metadata, {"k": [1, "b"], "j": [1, "b"], "new": (1, "c")})
+    assert merged == {"k": [2, "a"], "j": [1, "b"], "new": [1, "c"]}
+    assert key_versions.merge(None, {}) == {}
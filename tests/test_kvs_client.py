@@ -0,0 +1,14 @@
+from kvs_client import KVSClient
+
+def test_merges_vector_clocks():
+    client = KVSClient(["127.0.0.1:1"])
+    client._merge_metadata({"a": 1, "b": 3})
+    client._merge_metadata({"a": 2, "b": 1, "c": 1})
+    assert client.causal_metadata == {"a": 2, "b": 3, "c": 1}
+
+def test_merges_per_key_versions():
+    client = KVSClient(["127.0.0.1:1"])
+    client._merge_metadata({"x": [1, "10.0.0.2:8090"]})
+    client._merge_metadata({"x": [1, "10.0.0.3:8090"], "y": [2, "10.0.0.2:8090"]})
+    client._merge_metadata({"x": [1, "10.0.0.2:8090"]})
+    assert client.causal_metadata == {"x": [1, "10.0.0.3:8090"], "y": [2, "10.0.0.2:8090"]}
@@ -0,0 +1,44 @@
+import simulator as S
+
+def put(net, address, key, value, metadata=None):
+    return net.send(S.CLIENT, "PUT", f"http://{address}/kvs/{key}", json_body={"value": value, "causal-metadata": metadata})
+
+def test_concurrent_writes_of_a_key_converge():
+    net = S.SimNetwork()
+    view = S.build_cluster(net, 2, 1, "per-key")
+    x, y = sorted(view)
+    node_x = net.nodes[x]
+
+    # A client writes the key at Y while X is still replicating its own write of it
+    blast_put_key = node_x.blast_put_key
+    def interleaved(key, *args):
+        put(net, y, key, "fromY")
+        blast_put_key(key, *args)
+    node_x.blast_put_key = interleaved
+    res = put(net, x, "k", "fromX")
+    node_x.blast_put_key = blast_put_key
+
+    stores = {address: net.nodes[address].Store["k"] for address in view}
+    versions = {address: net.nodes[address].KeyVersion["k"] for address in view}
+    assert stores[x] == stores[y] == "fromY"
+    assert versions[x] == versions[y] == [1, y]
+    # The client is told the version of its own write, not the one that won
+    assert res.json()["causal-metadata"]["k"] == [1, x]
+
+def test_concurrent_delete_of_a_key_converges():
+    net = S.SimNetwork()
+    view = S.build_cluster(net, 2, 1, "per-key")
+    x, y = sorted(view)
+    put(net, x, "k", "first")
+    node_x = net.nodes[x]
+
+    blast_delete_key = node_x.blast_delete_key
+    def interleaved(key, *args):
+        put(net, y, key, "fromY")
+        blast_delete_key(key, *args)
+    node_x.blast_delete_key = interleaved
+    net.send(S.CLIENT, "DELETE", f"http://{x}/kvs/k", json_body={"causal-metadata": None})
+    node_x.blast_delete_key = blast_delete_key
+
+    assert net.nodes[x].Store.get("k") == net.nodes[y].Store.get("k")
+    assert net.nodes[x].KeyVersion["k"] == net.nodes[y].KeyVersion["k"]
@@ -0,0 +1,32 @@
+import simulator as S
+
+def misplaced_blob(net, view):
+    """
+    Puts a raw value at a replica whose shard does not own its key.
+    RETURN: The replica holding it, and the key
+    """
+    node = net.nodes[view[0]]
+    key = next(f"blob-{i}" for i in range(100) if node.consistentRing.key_to_shard(f"blob-{i}")[0] != node.current_shard)
+    node.BlobStore[key] = bytearray(b"x" * 100)
+    return node, key
+
+def test_migrated_raw_value_is_dropped_once_delivered():
+    net = S.SimNetwork()
+    view = S.build_cluster(net, 4, 2)
+    node, key = misplaced_blob(net, view)
+
+    node.migrate_blobs()
+
+    new_shard = node.consistentRing.key_to_shard(key)[0]
+    assert key not in node.BlobStore
+    assert all(net.nodes[rep].BlobStore[key] == b"x" * 100 for rep in node.shards[new_shard])
+
+def test_migrated_raw_value_is_kept_when_no_replica_takes_it():
+    net = S.SimNetwork()
+    view = S.build_cluster(net, 4, 2)
+    node, key = misplaced_blob(net, view)
+
+    net.partition([node.MY_ADDRESS], [address for address in view if address != node.MY_ADDRESS])
+    node.migrate_blobs()
+
+    assert node.BlobStore[key] == b"x" * 100
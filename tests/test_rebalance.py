@@ -0,0 +1,20 @@
+import pytest
+
+import simulator as S
+
+def test_load_counts_raw_values():
+    net = S.SimNetwork()
+    view = S.build_cluster(net, 2, 1)
+    net.send(S.CLIENT, "PUT", f"http://{view[0]}/kvs/blob/raw", data=b"x" * 5000,
+             headers={"Content-Type": "application/octet-stream"})
+
+    assert net.send(S.CLIENT, "GET", f"http://{view[1]}/shard/load").json()["bytes"] == 5004
+
+@pytest.mark.parametrize("body", [{"weights": ["s0"]}, {"weights": "s0"}, ["s0"]])
+def test_malformed_weights_are_rejected(body):
+    net = S.SimNetwork()
+    view = S.build_cluster(net, 4, 2)
+
+    res = net.send(S.CLIENT, "PUT", f"http://{view[0]}/shard/rebalance", json_body=body)
+
+    assert res.status_code == 400
@@ -0,0 +1,21 @@
+import simulator as S
+
+def test_keys_created_in_own_shard_are_not_pending():
+    net = S.SimNetwork()
+    view = S.build_cluster(net, 4, 2)
+    for i in range(10):
+        S.client_call(net, "PUT", view[0], f"/kvs/key-{i}", {"value": i, "causal-metadata": None})
+
+    for address in view:
+        node = net.nodes[address]
+        assert node.current_shard not in node.summary_pending
+
+def test_pending_keys_are_dropped_with_the_summaries():
+    net = S.SimNetwork()
+    view = S.build_cluster(net, 4, 2)
+    S.client_call(net, "PUT", view[0], "/kvs/key", {"value": 1, "causal-metadata": None})
+
+    S.client_call(net, "PUT", view[0], "/shard/reshard", {"shard-count": 2})
+
+    for address in view:
+        assert not net.nodes[address].summary_pending
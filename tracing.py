@@ -0,0 +1,193 @@
+import sys
+import time
+import uuid
+import random
+import functools
+import threading
+import contextvars
+import traceback
+from collections import OrderedDict, defaultdict, deque
+from urllib.parse import urlparse
+import requests
+
+TRACE_HEADER = "X-Trace-Id"
+SAMPLED_HEADER = "X-Trace-Sampled"
+
+current_trace = contextvars.ContextVar("current_trace", default=None)     # (trace id, sampled)
+current_stage = contextvars.ContextVar("current_stage", default="request")
+
+class Tracer:
+    def __init__(self, node, sample_rate=0.1, max_traces=200, window=1000):
+        """
+        Initializes a tracer that keeps the spans of recently sampled traces and
+        duration aggregates for every stage and peer, sampled or not.
+
+        :param node: The address of this replica, recorded on every span
+        :param sample_rate: The fraction of new traces whose spans are kept
+        :param max_traces: The number of recent sampled traces kept
+        :param window: The number of recent durations kept per stage for percentiles
+        """
+        self.node = node
+        self.sample_rate = sample_rate
+        self.max_traces = max_traces
+        self.window = window
+        self.lock = threading.Lock()
+        self.traces = OrderedDict()             # trace id -> list of spans
+        self.stages = defaultdict(lambda: {"count": 0, "errors": 0, "total-ms": 0.0, "max-ms": 0.0})
+        self.peers = defaultdict(lambda: {"count": 0, "errors": 0, "total-ms": 0.0, "max-ms": 0.0})
+        self.recent = defaultdict(lambda: deque(maxlen=self.window))
+
+    def start_request(self, headers):
+        """
+        Continues the trace named in the incoming <headers>, or starts a new one.
+        RETURN: A token used to restore the previous trace when the request ends
+        """
+        trace_id = headers.get(TRACE_HEADER)
+        if trace_id is None:
+            trace_id = uuid.uuid4().hex[:16]
+            sampled = random.random() < self.sample_rate
+        else:
+            sampled = headers.get(SAMPLED_HEADER) == "1"
+        return current_trace.set((trace_id, sampled))
+
+    def end_request(self, token):
+        """
+        Restores the trace that was current before the request started.
+        """
+        current_trace.reset(token)
+
+    def headers(self):
+        """
+        Returns the headers that carry the current trace to another replica.
+        """
+        trace = current_trace.get()
+        if trace is None:
+            return {}
+        return {TRACE_HEADER: trace[0], SAMPLED_HEADER: "1" if trace[1] else "0"}
+
+    def record(self, stage, peer, duration, status):
+        """
+        Records one timed operation.
+
+        :param stage: The code path the operation belongs to, e.g. "blast_vc"
+        :param peer: The replica that was contacted, or None for local work
+        :param duration: The duration in seconds
+        :param status: The HTTP status code, or the exception name if the call failed
+        """
+        duration_ms = duration * 1000
+        error = not isinstance(status, int) or status >= 500
+        with self.lock:
+            targets = [self.stages[stage]] + ([self.peers[peer]] if peer is not None else [])
+            for aggregate in targets:
+                aggregate["count"] += 1
+                aggregate["errors"] += error
+                aggregate["total-ms"] += duration_ms
+                aggregate["max-ms"] = max(aggregate["max-ms"], duration_ms)
+            self.recent[stage].append(duration_ms)
+
+            trace = current_trace.get()
+            if trace is None or not trace[1]:
+                return
+            spans = self.traces.setdefault(trace[0], [])
+            self.traces.move_to_end(trace[0])
+            spans.append({"node": self.node, "stage": stage, "peer": peer, "start": time.time() - duration,
+                          "duration-ms": round(duration_ms, 3), "status": status})
+            while len(self.traces) > self.max_traces:
+                self.traces.popitem(last=False)
+
+    def report(self, trace_id=None, limit=20):
+        """
+        Returns recent sampled traces and the aggregates of every stage and peer.
+
+        :param trace_id: Only return this trace, if given
+        :param limit: The number of most recent traces to return
+        """
+        with self.lock:
+            if trace_id is not None:
+                traces = {trace_id: list(self.traces.get(trace_id, []))}
+            else:
+                traces = {tid: list(spans) for tid, spans in list(self.traces.items())[-limit:]}
+
+            stages = {}
+            for stage, aggregate in self.stages.items():
+                durations = sorted(self.recent[stage])
+                stages[stage] = dict(aggregate,
+                                     **{"mean-ms": aggregate["total-ms"] / aggregate["count"],
+                                        "p50-ms": durations[len(durations) // 2],
+                                        "p99-ms": durations[min(len(durations) - 1, int(len(durations) * 0.99))]})
+            peers = {peer: dict(aggregate, **{"mean-ms": aggregate["total-ms"] / aggregate["count"]})
+                     for peer, aggregate in self.peers.items()}
+        return {"traces": traces, "stages": stages, "peers": peers}
+
+def stage(tracer):
+    """
+    Returns a decorator that times a function as its own stage, named after the function.
+    Calls to other replicas made inside the function are attributed to that stage.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = current_stage.set(func.__name__)
+            start = time.perf_counter()
+            status = 200
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                status = type(e).__name__
+                raise
+            finally:
+                tracer.record(func.__name__, None, time.perf_counter() - start, status)
+                current_stage.reset(token)
+        return wrapper
+    return decorator
+
+class TracedSession(requests.Session):
+    def __init__(self, tracer):
+        """
+        Initializes a pooled session that propagates the current trace to other replicas
+        and records a span for every call.
+
+        :param tracer: The Tracer the spans are recorded in
+        """
+        super().__init__()
+        self.tracer = tracer
+
+    def request(self, method, url, **kwargs):
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers.update(self.tracer.headers())
+        peer = urlparse(url).netloc
+        stage_name = f"{current_stage.get()}:{method.lower()}"
+        start = time.perf_counter()
+        try:
+            res = super().request(method, url, headers=headers, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self.tracer.record(stage_name, peer, time.perf_counter() - start, type(e).__name__)
+            raise
+        self.tracer.record(stage_name, peer, time.perf_counter() - start, res.status_code)
+        return res
+
+def sample_profile(seconds, interval=0.005, limit=30):
+    """
+    Samples the stacks of every other thread of this process for <seconds>.
+
+    :param seconds: How long to sample for
+    :param interval: The time between samples
+    :param limit: The number of most common stacks to return
+    RETURN: The number of samples and the most common stacks, outermost frame first
+    """
+    me = threading.get_ident()
+    stacks = defaultdict(int)
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            stack = ";".join(f"{entry.name} ({entry.filename.rsplit('/', 1)[-1]}:{entry.lineno})"
+                             for entry in traceback.extract_stack(frame))
+            stacks[stack] += 1
+        samples += 1
+        time.sleep(interval)
+
+    top = sorted(stacks.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return {"samples": samples, "interval": interval, "stacks": [{"stack": stack, "count": count} for stack, count in top]}